@@ -0,0 +1,230 @@
+"""Benchmark of the wash cycle against a fake evok.
+
+Runs every phase of the ``WashMachine.wash_cycle`` the way ``wash_the_kegs``
+does and reports, per phase, the HTTP exchanges and JSON-RPC calls made, the
+bytes on the wire, the wall and CPU time and how much the wall time
+overshoots the intended sleeps. Results can be appended to a JSON lines file
+and compared with the previous run.
+"""
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import threading
+import time
+
+import attr
+
+from pivovar.fake_evok import FakeEvok, FakeEvokServer
+from pivovar.jsonrpc import Client
+from pivovar.wash_machine import WashMachine
+
+
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+@attr.s
+class WireStats(object):
+    requests = attr.ib(default=0)
+    calls = attr.ib(default=0)
+    bytes_sent = attr.ib(default=0)
+    bytes_received = attr.ib(default=0)
+
+
+class MeteredClient(Client):
+    """Client counting the exchanges and the bytes it sends and receives."""
+
+    def __init__(self, url):
+        super(MeteredClient, self).__init__(url)
+        self.stats = WireStats()
+
+    def _post(self, payload):
+        data = json.dumps(payload)
+        resp = self.session.post(self.url, data=data, timeout=self.timeout)
+        self.stats.requests += 1
+        self.stats.calls += len(payload) if isinstance(payload, list) else 1
+        self.stats.bytes_sent += len(data)
+        self.stats.bytes_received += len(resp.content)
+        return resp.json()
+
+
+@contextmanager
+def counting_sleeps():
+    """Count the seconds the current thread asks ``time.sleep`` for."""
+    counter = {'seconds': 0.0}
+    sleep = time.sleep
+    thread = threading.current_thread()
+
+    def counting_sleep(seconds):
+        if threading.current_thread() is thread:
+            counter['seconds'] += seconds
+        sleep(seconds)
+
+    time.sleep = counting_sleep
+    try:
+        yield counter
+    finally:
+        time.sleep = sleep
+
+
+def benchmark_machine(tick_secs=0.001, transition_time=0.001):
+    wm = WashMachine('benchmark')
+    wm.init_io()
+    wm.io.water_temp.address = 'benchmark'
+    wm.tick_secs = tick_secs
+    for mv in wm.io.mv.leafs:
+        mv.transition_time = transition_time
+    return wm
+
+
+def run(wm, fake):
+    """Run the wash cycle of ``wm`` against ``fake``, return per phase stats."""
+    results = []
+    with FakeEvokServer(fake) as server:
+        wm.unipi_jsonrpc_url = server.url
+        wm._unipi_jsonrpc = client = MeteredClient(server.url)
+        for phase in wm.wash_cycle:
+            client.stats = WireStats()
+            with counting_sleeps() as slept:
+                wall = time.monotonic()
+                cpu = thread_time()
+                wm.prepare(phase)
+                phase()
+                cpu = thread_time() - cpu
+                wall = time.monotonic() - wall
+            result = dict(
+                attr.asdict(client.stats),
+                phase=phase.phase_name,
+                wall=wall,
+                cpu=cpu,
+                sleep=slept['seconds'],
+                overshoot=wall - slept['seconds'],
+            )
+            results.append(result)
+    return results
+
+
+def summarize(results):
+    total = {'phase': 'total'}
+    for key in results[0]:
+        if key != 'phase':
+            total[key] = sum(result[key] for result in results)
+    return total
+
+
+COLUMNS = (
+    ('phase', 24, None),
+    ('requests', 8, 0),
+    ('calls', 6, 0),
+    ('bytes_sent', 10, 0),
+    ('bytes_received', 14, 0),
+    ('wall', 8, 3),
+    ('cpu', 7, 3),
+    ('overshoot', 9, 3),
+)
+COMPARED = ('requests', 'calls', 'bytes_sent', 'cpu', 'overshoot')
+
+
+def format_table(results):
+    lines = [
+        ' '.join(
+            key.ljust(width) if precision is None else key.rjust(width)
+            for key, width, precision in COLUMNS
+        )
+    ]
+    for result in results + [summarize(results)]:
+        lines.append(
+            ' '.join(
+                (
+                    str(result[key]).ljust(width)
+                    if precision is None
+                    else '{:{}.{}f}'.format(result[key], width, precision)
+                )
+                for key, width, precision in COLUMNS
+            )
+        )
+    return '\n'.join(lines)
+
+
+def format_comparison(results, baseline):
+    baseline = {
+        result['phase']: result for result in baseline + [summarize(baseline)]
+    }
+    lines = []
+    for result in results + [summarize(results)]:
+        old = baseline.get(result['phase'])
+        if not old:
+            continue
+        changes = []
+        for key in COMPARED:
+            if old[key] != result[key]:
+                changes.append(
+                    '{} {:.3g} -> {:.3g}'.format(key, old[key], result[key])
+                )
+        if changes:
+            lines.append('{}: {}'.format(result['phase'], ', '.join(changes)))
+    return '\n'.join(lines) or 'No change against the baseline.'
+
+
+def store(path, record):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def load_last(path):
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--latency', type=float, default=0.0, help='Seconds per request.'
+    )
+    parser.add_argument(
+        '--jitter', type=float, default=0.0, help='Max extra seconds.'
+    )
+    parser.add_argument('--tick-secs', type=float, default=0.001)
+    parser.add_argument('--transition-time', type=float, default=0.001)
+    parser.add_argument(
+        '--output',
+        help='JSON lines file to append the results to and to compare them '
+        'with the last results stored.',
+    )
+    parser.add_argument('--label', default='', help='Label of the run.')
+    args = parser.parse_args()
+
+    wm = benchmark_machine(args.tick_secs, args.transition_time)
+    fake = FakeEvok.for_wash_machine(
+        wm, latency=args.latency, jitter=args.jitter, seed=0
+    )
+    results = run(wm, fake)
+    print(format_table(results))
+
+    if args.output:
+        baseline = load_last(args.output)
+        if baseline:
+            print()
+            print(
+                'Compared to {} {}:'.format(
+                    baseline['label'], baseline['datetime']
+                )
+            )
+            print(format_comparison(results, baseline['results']))
+        store(
+            args.output,
+            {
+                'datetime': datetime.now().isoformat(),
+                'label': args.label,
+                'options': vars(args),
+                'results': results,
+            },
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime
+import threading
+import time
+
+
+class Clock(object):
+    """The real time. Everything timed in the wash machine goes through a
+    clock, so the time can be sped up or simulated."""
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def async_sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+class ScaledClock(Clock):
+    """Time passing ``speed`` times faster than the real one."""
+
+    def __init__(self, speed):
+        self.speed = float(speed)
+        self._monotonic_start = time.monotonic()
+        self._time_start = time.time()
+
+    def _elapsed(self):
+        return (time.monotonic() - self._monotonic_start) * self.speed
+
+    def monotonic(self):
+        return self._monotonic_start + self._elapsed()
+
+    def time(self):
+        return self._time_start + self._elapsed()
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+    async def async_sleep(self, seconds):
+        await asyncio.sleep(seconds / self.speed)
+
+
+class VirtualClock(Clock):
+    """Time advancing only by sleeping, which returns immediately.
+
+    Runs timed code as fast as possible while it observes the same time as
+    if it really slept.
+    """
+
+    def __init__(self, start=None):
+        self._lock = threading.Lock()
+        self._time_start = time.time() if start is None else start
+        self._elapsed = 0.0
+
+    def monotonic(self):
+        return self._elapsed
+
+    def time(self):
+        return self._time_start + self._elapsed
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._elapsed += max(seconds, 0)
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+        # Let the other tasks run, as a real sleep would.
+        await asyncio.sleep(0)
@@ -0,0 +1,195 @@
+import json
+import logging
+import threading
+from collections import deque
+
+import attr
+
+
+logger = logging.getLogger('cycle_log')
+
+
+def percentile(values, q):
+    """Return the ``q`` (0 to 100) percentile of ``values``, interpolated."""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+@attr.s
+class PhaseRecord(object):
+    phase = attr.ib(type=str)
+    # Epoch seconds, for showing when it happened.
+    started = attr.ib(type=float)
+    # Seconds measured on the monotonic clock.
+    duration = attr.ib(type=float)
+    # 1 for the first attempt, more when the phase got repeated on error.
+    attempt = attr.ib(type=int, default=1)
+    error = attr.ib(default=None)
+    # How many attempts the record stands for, the repeated failures of a
+    # phase are merged into one record with the last error.
+    attempts = attr.ib(type=int, default=1)
+
+
+@attr.s
+class CycleRecord(object):
+    """Phases run while washing one keg."""
+
+    cycle = attr.ib(type=int)
+    started = attr.ib(type=float)
+    finished = attr.ib(default=None)
+    phases = attr.ib(default=attr.Factory(list))
+
+    @property
+    def duration(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def as_dict(self):
+        return dict(attr.asdict(self), duration=self.duration)
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data.pop('duration', None)
+        phases = [PhaseRecord(**phase) for phase in data.pop('phases')]
+        return cls(phases=phases, **data)
+
+
+class CycleLog(object):
+    """Timing of the phases of the last ``limit`` keg cycles.
+
+    The finished cycles are also appended as JSON lines to ``path`` when
+    given, and the last ones are loaded from it on start so the statistics
+    survive a restart of the service.
+
+    A phase failing again right after its failure extends the record of
+    that failure, so a phase retried for days keeps the cycle small.
+    """
+
+    def __init__(self, limit=100, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.cycles = deque(maxlen=limit)
+        self.current = None
+        # The attempts of each phase in the current cycle.
+        self._attempts = {}
+        self.count = 0
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        self.cycles.append(
+                            CycleRecord.from_dict(json.loads(line))
+                        )
+                    except (ValueError, TypeError, KeyError):
+                        logger.warning('Skipping a broken cycle record.')
+        except IOError:
+            return
+        if self.cycles:
+            self.count = self.cycles[-1].cycle
+
+    def start_cycle(self, time):
+        with self._lock:
+            self.count += 1
+            self.current = CycleRecord(self.count, time)
+            self._attempts = {}
+
+    def record_phase(self, record):
+        with self._lock:
+            if self.current is None:
+                # A phase run on its own, outside of a wash cycle.
+                self.count += 1
+                self.current = CycleRecord(self.count, record.started)
+                self._attempts = {}
+            phases = self.current.phases
+            attempt = self._attempts.get(record.phase, 0) + 1
+            self._attempts[record.phase] = attempt
+            last = phases[-1] if phases else None
+            if (
+                record.error is not None
+                and last is not None
+                and last.phase == record.phase
+                and last.error is not None
+            ):
+                last.attempts += 1
+                last.duration += record.duration
+                last.error = record.error
+                return
+            record.attempt = attempt
+            phases.append(record)
+
+    def finish_cycle(self, time):
+        with self._lock:
+            cycle, self.current = self.current, None
+            if cycle is None:
+                return
+            cycle.finished = time
+            self.cycles.append(cycle)
+        if self.path:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(cycle.as_dict()) + '\n')
+            except IOError as exc:
+                logger.error('Cannot store the cycle record: %s', exc)
+        return cycle
+
+    def recent(self, limit=None):
+        with self._lock:
+            cycles = list(self.cycles)
+        if limit is not None:
+            cycles = cycles[-limit:] if limit > 0 else []
+        return [cycle.as_dict() for cycle in cycles]
+
+    def stats(self):
+        """Percentiles of the phase and cycle durations and the throughput."""
+        with self._lock:
+            cycles = list(self.cycles)
+        durations = {}
+        errors = {}
+        for cycle in cycles:
+            for record in cycle.phases:
+                if record.error is None:
+                    durations.setdefault(record.phase, []).append(
+                        record.duration
+                    )
+                else:
+                    errors[record.phase] = (
+                        errors.get(record.phase, 0) + record.attempts
+                    )
+        phases = {
+            phase: {
+                'count': len(values),
+                'errors': errors.get(phase, 0),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+            }
+            for phase, values in durations.items()
+        }
+        for phase, count in errors.items():
+            phases.setdefault(
+                phase, {'count': 0, 'errors': count, 'p50': None, 'p95': None}
+            )
+
+        cycle_durations = [cycle.duration for cycle in cycles]
+        kegs_per_hour = None
+        if cycles:
+            span = cycles[-1].finished - cycles[0].started
+            if span > 0:
+                kegs_per_hour = len(cycles) * 3600.0 / span
+        return {
+            'cycles': len(cycles),
+            'cycle_p50': percentile(cycle_durations, 50),
+            'cycle_p95': percentile(cycle_durations, 95),
+            'kegs_per_hour': kegs_per_hour,
+            'phases': phases,
+        }
@@ -0,0 +1,75 @@
+"""Shape preserving downsampling of the temperature history for plotting.
+
+The samples are split into buckets of equal time and the minimum and the
+maximum of each bucket are kept, in their order, so the peaks and the drops
+stay visible however long the history is. The bucket boundaries are found
+by binary search, and the samples are only copied and compared by builtins
+implemented in C (``array.extend``, ``min``/``max``, ``index``), so the
+interpreted Python code runs once per bucket rather than once per sample.
+"""
+from array import array
+from bisect import bisect_left
+from itertools import filterfalse
+from math import isnan
+
+
+def gather(temp_log, start, stop):
+    """Return the times and temperatures between the cursors as arrays."""
+    times = array('d')
+    temps = array('d')
+    for times_column, temps_column in temp_log.columns(start, stop):
+        # The columns are arrays of other types or strided memoryviews,
+        # which the array copies in C through an iterator.
+        times.extend(iter(times_column))
+        temps.extend(iter(temps_column))
+    return times, temps
+
+
+def min_max(times, temps, width):
+    """Downsample to the minimum and maximum of every ``width`` seconds.
+
+    A bucket with all the temperatures missing is kept as one missing
+    sample, so the gap shows in the plot.
+    """
+    out_times = []
+    out_temps = []
+    if not times:
+        return out_times, out_temps
+    n = len(times)
+    first = times[0]
+    lo = 0
+    while lo < n:
+        # The bucket of the next sample, the empty ones are skipped.
+        bucket = (times[lo] - first) // width
+        hi = max(bisect_left(times, first + (bucket + 1) * width, lo), lo + 1)
+        chunk = temps[lo:hi]
+        present = chunk
+        if isnan(chunk[0]):
+            # min() and max() never pick a NaN, unless they start with one.
+            present = list(filterfalse(isnan, chunk))
+        if not present:
+            out_times.append(times[lo])
+            out_temps.append(chunk[0])
+        else:
+            i_min = lo + chunk.index(min(present))
+            i_max = lo + chunk.index(max(present))
+            for i in sorted({i_min, i_max}):
+                out_times.append(times[i])
+                out_temps.append(temps[i])
+        lo = hi
+    return out_times, out_temps
+
+
+def downsample(times, temps, max_points=None, resolution=None):
+    """Downsample to ``resolution`` seconds buckets or to at most
+    ``max_points`` samples. Returned unchanged when already small enough."""
+    if resolution:
+        return min_max(times, temps, resolution)
+    if max_points and len(times) > max_points:
+        buckets = max(max_points // 2, 1)
+        # A bit wider, so the last sample fits into the last bucket despite
+        # the rounding of the epoch times.
+        width = (times[-1] - times[0]) / buckets + abs(times[-1]) * 1e-12
+        if width > 0:
+            return min_max(times, temps, width)
+    return list(times), list(temps)
@@ -0,0 +1,59 @@
+"""Dry run of the wash cycle against simulated IO.
+
+Checks a recipe change without a Neuron and without waiting the real
+durations: the time is either sped up or virtual, advancing instantly.
+"""
+from pivovar.clock import ScaledClock, VirtualClock
+from pivovar.fake_evok import FakeEvok, LocalClient
+
+
+def clock_for_speed(speed):
+    """Return a clock running ``speed`` times faster, virtual for 0."""
+    if speed:
+        return ScaledClock(speed)
+    return VirtualClock()
+
+
+def dry_run(wm, cycles=1):
+    """Run the wash cycle of ``wm`` against simulated IO.
+
+    The ``wm`` is expected to be constructed with the clock of the dry run.
+    Returns the timeline as a list of ``(offset, duration, phase)`` in
+    seconds since the start.
+    """
+    fake = FakeEvok.for_wash_machine(wm, temp=wm.required_water_temp)
+    wm._unipi_jsonrpc = LocalClient(fake)
+    events = wm.events.subscribe(queue_size=0)
+    start = wm.clock.time()
+    try:
+        for _ in range(cycles):
+            wm.cycle_started()
+            for phase in wm.wash_cycle:
+                wm.prepare(phase)
+                phase()
+            wm.cycle_finished()
+    finally:
+        wm.events.unsubscribe(events)
+
+    timeline = []
+    while not events.empty():
+        event, data = events.get_nowait()
+        if event != 'phase':
+            continue
+        offset = data['time'] - start
+        if timeline and timeline[-1][1] is None:
+            timeline[-1] = (
+                timeline[-1][0],
+                offset - timeline[-1][0],
+                timeline[-1][2],
+            )
+        if data['current_phase'] != 'idle':
+            timeline.append((offset, None, data['current_phase']))
+    return timeline
+
+
+def format_timeline(timeline):
+    return '\n'.join(
+        '{:>9.1f}s {:>7.1f}s  {}'.format(offset, duration or 0.0, phase)
+        for offset, duration, phase in timeline
+    )
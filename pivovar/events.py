@@ -0,0 +1,74 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+
+logger = logging.getLogger('events')
+
+
+def format_sse(event, data):
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+
+class EventBroker(object):
+    """Fans the published events out to the queues of the subscribers.
+
+    Every subscriber has its own bounded queue. A subscriber that does not
+    keep up loses the events that do not fit into its queue instead of
+    slowing down the publisher.
+
+    Every event also counts as a new version of the state it announces,
+    see :meth:`version`.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._created = time.time()
+        self._versions = {}
+
+    def version(self, event):
+        """Return how many times ``event`` was published and when it was
+        published last (epoch seconds, the creation time if never)."""
+        return self._versions.get(event, (0, self._created))
+
+    def subscribe(self, queue_size=None):
+        q = queue.Queue(self.queue_size if queue_size is None else queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            count = self._versions.get(event, (0, None))[0]
+            self._versions[event] = (count + 1, time.time())
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                logger.warning(
+                    'Dropping event %s for a slow subscriber.', event
+                )
+
+    def stream(self, keepalive_seconds=15.0):
+        """Generate the Server-Sent Events for a new subscriber."""
+        q = self.subscribe()
+        try:
+            while True:
+                try:
+                    event, data = q.get(timeout=keepalive_seconds)
+                except queue.Empty:
+                    # Comment line keeping the connection open.
+                    yield ': keepalive\n\n'
+                else:
+                    yield format_sse(event, data)
+        finally:
+            self.unsubscribe(q)
@@ -0,0 +1,259 @@
+"""Stand-in for the evok JSON-RPC API of a UniPi.
+
+Keeps the relays, inputs and 1-Wire sensors in memory and serves the methods
+used by :class:`pivovar.jsonrpc.Client` over HTTP, with configurable latency,
+jitter and error rate. Meant for running a :class:`WashMachine` end-to-end
+and measuring the RPC cost without a Neuron at hand.
+"""
+import argparse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import random
+from socketserver import ThreadingMixIn
+import threading
+import time
+
+from pivovar.jsonrpc import Client
+
+
+logger = logging.getLogger('fake_evok')
+
+METHOD_NOT_FOUND = -32601
+SERVER_ERROR = -32000
+
+
+class FakeEvokError(Exception):
+    def __init__(self, message, code=SERVER_ERROR):
+        super(FakeEvokError, self).__init__(message)
+        self.code = code
+
+
+class FakeEvok(object):
+    """In-memory state and JSON-RPC dispatch of a fake UniPi."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.relays = {}
+        self.inputs = {}
+        # address: [value, lost, time, interval]
+        self.sensors = {}
+        self.owbus = {'1': {'scan_interval': 300}}
+        self.calls = Counter()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_wash_machine(cls, wm, temp=80.0, **kwds):
+        """Return a fake with all the IO of the ``wm`` defined."""
+        self = cls(**kwds)
+        for io in wm.io.rly.leafs + wm.io.out.leafs + wm.io.mv.leafs:
+            self.relays[io.alias] = 0
+        for io in wm.io.inp.leafs:
+            self.inputs[io.alias] = 0
+        self.inputs[wm.io.inp.fuse_ok.alias] = 1
+        self.inputs[wm.io.inp.keg_present.alias] = 1
+        self.sensors[wm.io.water_temp.address] = [temp, False, 0.0, 15]
+        return self
+
+    def delay(self):
+        """Sleep for the configured latency of one HTTP exchange."""
+        seconds = self.latency + self.random.uniform(0, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _lookup(self, table, key):
+        try:
+            return table[key]
+        except KeyError:
+            raise FakeEvokError('Invalid circuit {}'.format(key))
+
+    def relay_get(self, relay):
+        return [self._lookup(self.relays, relay), False]
+
+    def relay_set(self, relay, value):
+        self._lookup(self.relays, relay)
+        self.relays[relay] = int(bool(value))
+        return self.relays[relay]
+
+    def input_get(self, input):
+        return [self._lookup(self.inputs, input), 0, 'Disabled', 0]
+
+    def input_get_value(self, input):
+        return self._lookup(self.inputs, input)
+
+    def sensor_get(self, sensor):
+        value, lost, _, interval = self._lookup(self.sensors, sensor)
+        return [value, lost, time.time(), interval]
+
+    def sensor_get_value(self, sensor):
+        return self._lookup(self.sensors, sensor)[0]
+
+    def owbus_get(self, circuit):
+        return self._lookup(self.owbus, circuit)
+
+    def owbus_set(self, circuit, scan_interval):
+        self._lookup(self.owbus, circuit)['scan_interval'] = scan_interval
+        return self.owbus[circuit]
+
+    def owbus_list(self, circuit):
+        self._lookup(self.owbus, circuit)
+        return list(self.sensors)
+
+    def owbus_scan(self, circuit):
+        return self.owbus_list(circuit)
+
+    METHODS = (
+        'relay_get',
+        'relay_set',
+        'input_get',
+        'input_get_value',
+        'sensor_get',
+        'sensor_get_value',
+        'owbus_get',
+        'owbus_set',
+        'owbus_list',
+        'owbus_scan',
+    )
+
+    def call(self, request):
+        """Dispatch a single JSON-RPC request, return the response."""
+        method = request.get('method')
+        resp = {'jsonrpc': '2.0', 'id': request.get('id')}
+        try:
+            if method not in self.METHODS:
+                raise FakeEvokError(
+                    'Method not found: {}'.format(method), METHOD_NOT_FOUND
+                )
+            self.calls[method] += 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                raise FakeEvokError('Injected failure of {}'.format(method))
+            resp['result'] = getattr(self, method)(*request.get('params', ()))
+        except FakeEvokError as exc:
+            resp['error'] = {'code': exc.code, 'message': str(exc)}
+        return resp
+
+    def handle(self, payload):
+        """Dispatch a JSON-RPC request or a batch of them."""
+        with self._lock:
+            self.requests += 1
+            if isinstance(payload, list):
+                return [self.call(request) for request in payload]
+            return self.call(payload)
+
+
+class LocalClient(Client):
+    """Client calling a :class:`FakeEvok` directly, without any HTTP."""
+
+    def __init__(self, fake):
+        super(LocalClient, self).__init__('local:')
+        self.fake = fake
+
+    def _post(self, payload):
+        # Round-trip through JSON like the real exchange does.
+        return json.loads(
+            json.dumps(self.fake.handle(json.loads(json.dumps(payload))))
+        )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, do not let the
+    # delayed ACKs add their latency to every exchange.
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length).decode())
+        fake.delay()
+        body = json.dumps(fake.handle(payload)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class FakeEvokServer(ThreadingMixIn, HTTPServer):
+    """HTTP server exposing a :class:`FakeEvok` at ``url``.
+
+    Usable as a context manager serving from a background thread::
+
+        with FakeEvokServer(FakeEvok.for_wash_machine(wm)) as server:
+            wm.unipi_jsonrpc_url = server.url
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fake, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), _Handler)
+        self.fake = fake
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}/rpc'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(
+            name='fake evok',
+            target=self.serve_forever,
+            kwargs={'poll_interval': 0.05},
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument(
+        '--latency', type=float, default=0.0, help='Seconds per request.'
+    )
+    parser.add_argument(
+        '--jitter', type=float, default=0.0, help='Max extra seconds.'
+    )
+    parser.add_argument(
+        '--error-rate', type=float, default=0.0, help='Failing calls ratio.'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Imported here, the module reads pivovar.cfg when imported.
+    from pivovar.wash_machine import WashMachine
+
+    wm = WashMachine.from_config('wash_machine_1')
+    fake = FakeEvok.for_wash_machine(
+        wm,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    )
+    server = FakeEvokServer(fake, args.host, args.port)
+    logger.info('Serving fake evok at %s', server.url)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
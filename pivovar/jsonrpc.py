@@ -1,9 +1,19 @@
+import asyncio
+import itertools
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
 
 import logging
 
+from pivovar import metrics
 
+
+logger = logging.getLogger('jsonrpc')
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -19,32 +29,353 @@ class ProtocolError(Exception):
     pass
 
 
+class CircuitOpenError(ConnectionError):
+    """The call was not even tried, the UniPi stopped responding."""
+
+
+# The calls only reading the state, safe to be sent again.
+IDEMPOTENT_METHODS = frozenset(
+    (
+        'relay_get',
+        'sensor_get',
+        'sensor_get_value',
+        'owbus_get',
+        'owbus_list',
+        'input_get',
+        'input_get_value',
+    )
+)
+TRANSPORT_ERRORS = (
+    requests.RequestException,
+    ConnectionError,
+    asyncio.TimeoutError,
+)
+TIMEOUT_ERRORS = (requests.Timeout, asyncio.TimeoutError)
+
+
+_NO_RESPONSE = {
+    'error': {'message': 'No response for the call.', 'code': None}
+}
+
+
+def _raise_for_error(resp):
+    error = resp.get('error')
+    if error:
+        raise ProtocolError(error['message'], error['code'])
+    return resp['result']
+
+
+def _coalescing_key(payload):
+    """Key of the calls giving the same response, whatever their ids."""
+    calls = [payload] if isinstance(payload, dict) else payload
+    return json.dumps([[call['method'], call['params']] for call in calls])
+
+
+def _rekey(sent, resp, payload):
+    """Return ``resp`` to the ``sent`` payload as the response to the
+    equivalent ``payload``, which has its own ids."""
+    if isinstance(payload, dict):
+        return dict(resp, id=payload['id'])
+    if isinstance(resp, dict):
+        # The server refused the batch as a whole.
+        return resp
+    by_id = {item.get('id'): item for item in resp}
+    return [
+        dict(by_id.get(mine['id'], _NO_RESPONSE), id=theirs['id'])
+        for mine, theirs in zip(sent, payload)
+    ]
+
+
+class _InFlight(object):
+    """Call being sent, other threads asking the same wait for its result."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.done = threading.Event()
+        self.resp = None
+        self.exc = None
+
+
+class CircuitBreaker(object):
+    """Fails the calls fast while the UniPi is not responding.
+
+    After ``failure_threshold`` consecutive transport failures the circuit
+    opens and the calls raise :class:`CircuitOpenError` right away. After
+    ``reset_seconds`` the calls are let through again; the first failure
+    opens the circuit again, the first success closes it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.opened_at = None
+        self.rejected = 0
+        self.last_error = None
+
+    def before_call(self):
+        with self._lock:
+            if self.state != self.OPEN:
+                return
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                self.rejected += 1
+                raise CircuitOpenError(
+                    'Circuit open after {} failures: {}'.format(
+                        self.failures, self.last_error
+                    )
+                )
+            self.state = self.HALF_OPEN
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info('The UniPi responds again, closing the circuit.')
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self, exc):
+        with self._lock:
+            self.failures += 1
+            self.last_error = repr(exc)
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED
+                and self.failures >= self.failure_threshold
+            ):
+                logger.error(
+                    'The UniPi does not respond, opening the circuit: %s', exc
+                )
+                self.state = self.OPEN
+                self.opened += 1
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget(object):
+    """Token bucket capping the retries to ``ratio`` of the calls, so the
+    retries cannot multiply the load of a struggling UniPi."""
+
+    def __init__(self, ratio=0.2, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self.tokens = max_tokens
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
 class Client(object):
-    def __init__(self, url):
-        self.counter = 0
+    """JSON-RPC client of the evok API of a UniPi.
+
+    Every exchange is bounded by the ``(connect, read)`` ``timeout``. Calls
+    only reading the state are retried up to ``retries`` times on transport
+    errors after a jittered exponential ``backoff``, as long as the
+    :class:`RetryBudget` allows. A call thus takes at most
+    :attr:`max_call_seconds`. The :class:`CircuitBreaker` fails the calls
+    fast once the UniPi stops responding.
+
+    The client is safe to be shared by threads. The requests ids are unique,
+    up to ``pool_size`` exchanges run in parallel over their own kept-alive
+    connections, and the same reads asked by several threads at once are
+    sent only once, all of them getting the response.
+    """
+
+    def __init__(
+        self,
+        url,
+        timeout=(1.0, 2.0),
+        retries=2,
+        backoff=0.05,
+        failure_threshold=5,
+        reset_seconds=5.0,
+        pool_size=4,
+    ):
         self.url = url
         self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._init_resilience(
+            timeout, retries, backoff, failure_threshold, reset_seconds
+        )
 
-    def _jsonrpc_args_method(self, method, *args):
-        self.counter += 1
-        resp = self.session.post(
-            self.url,
-            data=json.dumps(
-                {
-                    'id': self.counter,
-                    'jsonrpc': '2.0',
-                    'method': method,
-                    'params': args,
-                }
-            ),
+    def _init_resilience(
+        self, timeout, retries, backoff, failure_threshold, reset_seconds
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.budget = RetryBudget()
+        self.retried = 0
+        self.timeouts = 0
+        self.coalesced = 0
+        # next() of the count is atomic, no lock is needed for the ids.
+        self._ids = itertools.count(1)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    @property
+    def max_call_seconds(self):
+        """Upper bound of the duration of a call, retries included."""
+        exchange = sum(self.timeout) if self.timeout else float('inf')
+        backoff = sum(
+            self.backoff * 2 ** attempt * 1.5
+            for attempt in range(self.retries)
+        )
+        return exchange * (self.retries + 1) + backoff
+
+    def health(self):
+        breaker = self.breaker
+        return {
+            'url': self.url,
+            'state': breaker.state,
+            'consecutive_failures': breaker.failures,
+            'opened': breaker.opened,
+            'rejected': breaker.rejected,
+            'last_error': breaker.last_error,
+            'retried': self.retried,
+            'timeouts': self.timeouts,
+            'coalesced': self.coalesced,
+            'max_call_seconds': self.max_call_seconds,
+        }
+
+    @staticmethod
+    def _idempotent(payload):
+        if isinstance(payload, dict):
+            return payload['method'] in IDEMPOTENT_METHODS
+        return all(
+            request['method'] in IDEMPOTENT_METHODS for request in payload
+        )
+
+    def _should_retry(self, payload, attempt, exc):
+        """Account the failure, return the seconds to wait before trying
+        again or None when the call is not to be retried."""
+        self.breaker.record_failure(exc)
+        if isinstance(exc, TIMEOUT_ERRORS):
+            self.timeouts += 1
+        if (
+            attempt >= self.retries
+            or self.breaker.state != CircuitBreaker.CLOSED
+            or not self._idempotent(payload)
+            or not self.budget.withdraw()
+        ):
+            return None
+        self.retried += 1
+        metrics.RPC_RETRIES.labels(
+            payload['method'] if isinstance(payload, dict) else 'batch'
+        ).inc()
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def _send(self, payload):
+        """Post the ``payload``, sharing the response of the same reads
+        already in flight."""
+        if not self._idempotent(payload):
+            return self._send_now(payload)
+        key = _coalescing_key(payload)
+        with self._inflight_lock:
+            inflight = self._inflight.get(key)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[key] = _InFlight(payload)
+            else:
+                self.coalesced += 1
+        if not leader:
+            # Bounded by the timeouts of the leading call.
+            inflight.done.wait()
+            if inflight.exc is not None:
+                raise inflight.exc
+            return _rekey(inflight.payload, inflight.resp, payload)
+        try:
+            inflight.resp = self._send_now(payload)
+        except Exception as exc:
+            inflight.exc = exc
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            inflight.done.set()
+        return inflight.resp
+
+    def _send_now(self, payload):
+        """Post the ``payload`` through the breaker, retrying if safe."""
+        self.breaker.before_call()
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                resp = self._metered_post(payload)
+            except TRANSPORT_ERRORS as exc:
+                delay = self._should_retry(payload, attempt, exc)
+                if delay is None:
+                    raise
+                logger.warning(
+                    'Retrying the call to %s in %.3fs: %s',
+                    self.url,
+                    delay,
+                    exc,
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return resp
+
+    def _next_id(self):
+        return next(self._ids)
+
+    def _request(self, method, args):
+        return {
+            'id': self._next_id(),
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': args,
+        }
+
+    def _post(self, payload):
+        return self.session.post(
+            self.url, data=json.dumps(payload), timeout=self.timeout
         ).json()
 
-        error = resp.get('error')
-        if error:
-            exc = ProtocolError(error['message'], error['code'])
-            raise exc
-        else:
-            return resp['result']
+    def _metered_post(self, payload):
+        started = time.monotonic()
+        resp = None
+        try:
+            resp = self._post(payload)
+        finally:
+            metrics.observe_rpc(payload, resp, time.monotonic() - started)
+        return resp
+
+    def _jsonrpc_args_method(self, method, *args):
+        return _raise_for_error(self._send(self._request(method, args)))
+
+    def batch(self):
+        """Return a :class:`Batch` collecting calls into one HTTP exchange.
+
+        The batch is sent when leaving the ``with`` block::
+
+            with client.batch() as batch:
+                air = batch.relay_get('al_air')
+                fuse = batch.input_get_value('al_fuse_ok')
+            air.result(), fuse.result()
+        """
+        return Batch(self)
 
     def relay_get(self, relay):
         return self._jsonrpc_args_method("relay_get", relay)
@@ -75,3 +406,287 @@ class Client(object):
 
     def input_get_value(self, input):
         return self._jsonrpc_args_method("input_get_value", input)
+
+
+class BatchCall(object):
+    """Placeholder for the result of a call queued in a :class:`Batch`."""
+
+    def __init__(self, request):
+        self.request = request
+        self._response = None
+
+    @property
+    def done(self):
+        return self._response is not None
+
+    def result(self):
+        if not self.done:
+            raise ProtocolError(
+                'Batch call {} has not been sent yet.'.format(
+                    self.request['method']
+                ),
+                None,
+            )
+        return _raise_for_error(self._response)
+
+
+class Batch(Client):
+    """Collects JSON-RPC calls and sends them as one JSON-RPC 2.0 batch.
+
+    All the :class:`Client` methods are available and return
+    :class:`BatchCall` placeholders instead of the results.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def _jsonrpc_args_method(self, method, *args):
+        call = BatchCall(self.client._request(method, args))
+        self.calls.append(call)
+        return call
+
+    @staticmethod
+    def _resolve(calls, resp):
+        if isinstance(resp, dict):
+            # The server refused the batch as a whole.
+            resp = [dict(resp, id=call.request['id']) for call in calls]
+        by_id = {item.get('id'): item for item in resp}
+        for call in calls:
+            call._response = by_id.get(call.request['id'], _NO_RESPONSE)
+        return calls
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        if not calls:
+            return calls
+        resp = self.client._send([call.request for call in calls])
+        return self._resolve(calls, resp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+
+class AsyncClient(Client):
+    """Asyncio flavour of the :class:`Client`.
+
+    All the methods are coroutines. The JSON-RPC requests are sent over
+    kept-alive HTTP/1.1 connections opened with asyncio streams, so no
+    thread is needed for the IO. Up to ``pool_size`` exchanges run at once,
+    each over its own connection, and the same reads asked by several tasks
+    at once are sent only once.
+    """
+
+    def __init__(
+        self,
+        url,
+        timeout=(1.0, 2.0),
+        retries=2,
+        backoff=0.05,
+        failure_threshold=5,
+        reset_seconds=5.0,
+        pool_size=4,
+    ):
+        self.url = url
+        self.pool_size = pool_size
+        self._init_resilience(
+            timeout, retries, backoff, failure_threshold, reset_seconds
+        )
+        split = urlsplit(url)
+        self._host = split.hostname
+        self._port = split.port or 80
+        self._path = split.path or '/'
+        if split.query:
+            self._path += '?' + split.query
+        self._idle = []
+        self._slots = None
+
+    async def _connect(self):
+        connecting = asyncio.open_connection(self._host, self._port)
+        if not self.timeout:
+            return await connecting
+        return await asyncio.wait_for(connecting, self.timeout[0])
+
+    async def _acquire(self, fresh=False):
+        """Return an idle connection or a new one, waiting for a free slot
+        of the pool."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        await self._slots.acquire()
+        if self._idle and not fresh:
+            return self._idle.pop()
+        try:
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, streams, reusable):
+        if reusable:
+            self._idle.append(streams)
+        else:
+            streams[1].close()
+        self._slots.release()
+
+    def close(self):
+        """Close the idle connections, the ones in use close when done."""
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by the server.')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if not size:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await reader.readexactly(
+                int(headers.get('content-length', 0))
+            )
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        return status, body, keep_alive
+
+    async def _exchange(self, streams, data):
+        reader, writer = streams
+        writer.write(
+            'POST {} HTTP/1.1\r\n'
+            'Host: {}\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {}\r\n'
+            '\r\n'.format(self._path, self._host, len(data)).encode('latin-1')
+            + data
+        )
+        await writer.drain()
+        return await self._read_response(reader)
+
+    async def _timed_exchange(self, streams, data):
+        if not self.timeout:
+            return await self._exchange(streams, data)
+        # On timeout the response may still arrive, the connection is not
+        # reused then.
+        return await asyncio.wait_for(
+            self._exchange(streams, data), self.timeout[1]
+        )
+
+    async def _post(self, payload):
+        data = json.dumps(payload).encode()
+        fresh = False
+        while True:
+            streams = await self._acquire(fresh)
+            reusable = False
+            try:
+                status, body, reusable = await self._timed_exchange(
+                    streams, data
+                )
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if fresh:
+                    raise
+                # The server may have dropped the kept-alive connection.
+                fresh = True
+                continue
+            finally:
+                self._release(streams, reusable)
+            break
+        if status != 200:
+            raise ProtocolError('HTTP status {}'.format(status), status)
+        return json.loads(body.decode())
+
+    async def _metered_post(self, payload):
+        started = time.monotonic()
+        resp = None
+        try:
+            resp = await self._post(payload)
+        finally:
+            metrics.observe_rpc(payload, resp, time.monotonic() - started)
+        return resp
+
+    async def _send(self, payload):
+        if not self._idempotent(payload):
+            return await self._send_now(payload)
+        key = _coalescing_key(payload)
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            # A task of its own, so cancelling the caller that started it
+            # does not cancel the request the others wait for too.
+            task = asyncio.ensure_future(self._send_now(payload))
+            inflight = self._inflight[key] = (payload, task)
+
+            def finished(task):
+                del self._inflight[key]
+                if not task.cancelled():
+                    # Retrieved, so a call nobody waited for is not logged.
+                    task.exception()
+
+            task.add_done_callback(finished)
+        else:
+            self.coalesced += 1
+        sent, task = inflight
+        # Shielded, so a cancelled caller does not cancel the request.
+        resp = await asyncio.shield(task)
+        return resp if sent is payload else _rekey(sent, resp, payload)
+
+    async def _send_now(self, payload):
+        self.breaker.before_call()
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                resp = await self._metered_post(payload)
+            except TRANSPORT_ERRORS as exc:
+                delay = self._should_retry(payload, attempt, exc)
+                if delay is None:
+                    raise
+                logger.warning(
+                    'Retrying the call to %s in %.3fs: %s',
+                    self.url,
+                    delay,
+                    exc,
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return resp
+
+    async def _jsonrpc_args_method(self, method, *args):
+        return _raise_for_error(await self._send(self._request(method, args)))
+
+    def batch(self):
+        """Return an :class:`AsyncBatch`, use it with ``async with``."""
+        return AsyncBatch(self)
+
+
+class AsyncBatch(Batch):
+    async def execute(self):
+        calls, self.calls = self.calls, []
+        if not calls:
+            return calls
+        resp = await self.client._send([call.request for call in calls])
+        return self._resolve(calls, resp)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.execute()
@@ -0,0 +1,242 @@
+"""Counters and histograms exported in the Prometheus text format.
+
+A minimal stand-in for the ``prometheus_client`` covering what the wash
+service needs. Updating a metric is a dictionary lookup and a short locked
+section, cheap enough for every JSON-RPC call.
+"""
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+import threading
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+PHASE_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(
+        ','.join(
+            '{}="{}"'.format(
+                name,
+                str(value)
+                .replace('\\', '\\\\')
+                .replace('\n', '\\n')
+                .replace('"', '\\"'),
+            )
+            for name, value in labels
+        )
+    )
+
+
+class _CounterValue(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield '_total', (), self.value
+
+
+class _HistogramValue(object):
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # The last one counts the observations above the largest bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield '_bucket', (('le', _format_value(bound)),), cumulative
+        yield '_sum', (), total
+        yield '_count', (), cumulative
+
+
+class Metric(ABC):
+    """Family of the values of a metric, one per combination of labels."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    @abstractmethod
+    def _new_value(self):
+        """Return the value kept for a new combination of labels."""
+
+    def labels(self, *values):
+        try:
+            return self._values[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    '{} expects labels {}.'.format(self.name, self.labelnames)
+                )
+            with self._lock:
+                return self._values.setdefault(values, self._new_value())
+
+    def render(self):
+        name = self.name
+        if self.type == 'counter':
+            name = name[: -len('_total')]
+        lines = [
+            '# HELP {} {}'.format(name, self.documentation),
+            '# TYPE {} {}'.format(name, self.type),
+        ]
+        for values, value in sorted(self._values.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for suffix, extra, sample in value.samples():
+                lines.append(
+                    '{}{}{} {}'.format(
+                        name,
+                        suffix,
+                        _format_labels(labels + extra),
+                        _format_value(sample),
+                    )
+                )
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        if not name.endswith('_total'):
+            raise ValueError('Counter names end with _total.')
+        super(Counter, self).__init__(name, documentation, labelnames)
+
+    def _new_value(self):
+        return _CounterValue()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS
+    ):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+
+RPC_CALLS = Counter(
+    'pivovar_rpc_calls_total', 'JSON-RPC calls made to evok.', ('method',)
+)
+RPC_ERRORS = Counter(
+    'pivovar_rpc_errors_total',
+    'JSON-RPC calls answered by an error or not answered at all.',
+    ('method',),
+)
+RPC_RETRIES = Counter(
+    'pivovar_rpc_retries_total',
+    'JSON-RPC exchanges sent again after a transport error.',
+    ('method',),
+)
+RPC_LATENCY = Histogram(
+    'pivovar_rpc_latency_seconds',
+    'Duration of the HTTP exchanges with evok, batches as "batch".',
+    ('method',),
+)
+PHASE_DURATION = Histogram(
+    'pivovar_phase_duration_seconds',
+    'Duration of the wash machine phases.',
+    ('machine', 'phase'),
+    buckets=PHASE_BUCKETS,
+)
+SAMPLER_LAG = Histogram(
+    'pivovar_sampler_lag_seconds',
+    'How late the temperature samples are taken against their period.',
+    ('machine',),
+)
+
+REGISTRY = (
+    RPC_CALLS,
+    RPC_ERRORS,
+    RPC_RETRIES,
+    RPC_LATENCY,
+    PHASE_DURATION,
+    SAMPLER_LAG,
+)
+
+
+def observe_rpc(payload, resp, seconds):
+    """Account the JSON-RPC ``payload`` answered by ``resp``.
+
+    ``resp`` is None when the exchange failed without a response.
+    """
+    if isinstance(payload, dict):
+        RPC_LATENCY.labels(payload['method']).observe(seconds)
+        RPC_CALLS.labels(payload['method']).inc()
+        if not isinstance(resp, dict) or resp.get('error'):
+            RPC_ERRORS.labels(payload['method']).inc()
+        return
+
+    RPC_LATENCY.labels('batch').observe(seconds)
+    if isinstance(resp, list):
+        failed = {item.get('id') for item in resp if item.get('error')}
+        answered = {item.get('id') for item in resp}
+    else:
+        # No response or the batch refused as a whole.
+        failed = answered = None
+    for request in payload:
+        RPC_CALLS.labels(request['method']).inc()
+        if (
+            failed is None
+            or request['id'] in failed
+            or request['id'] not in answered
+        ):
+            RPC_ERRORS.labels(request['method']).inc()
+
+
+def render(metrics=REGISTRY):
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
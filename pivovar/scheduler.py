@@ -0,0 +1,118 @@
+import attr
+from contextlib import contextmanager
+import logging
+
+from pivovar.clock import Clock
+
+
+logger = logging.getLogger('scheduler')
+
+
+@attr.s
+class Step(object):
+    name = attr.ib(type=str)
+    # Seconds since the start of the schedule.
+    planned = attr.ib(type=float)
+    actual = attr.ib(type=float)
+    duration = attr.ib(type=float, default=0.0)
+
+    @property
+    def lag(self):
+        return self.actual - self.planned
+
+    def as_dict(self):
+        return dict(attr.asdict(self), lag=self.lag)
+
+
+class Schedule(object):
+    """Plans the timed steps of a phase against absolute deadlines.
+
+    :meth:`wait` sleeps until a deadline on the monotonic clock instead of
+    for a duration, so the time spent in the RPCs between the waits does not
+    accumulate. The actions run through :meth:`step` are timed and the
+    following deadlines are brought forward by their average latency, so the
+    actions take effect on time rather than late.
+
+    A lag larger than ``max_lag`` (a valve switching, a pause on a pressed
+    total stop) is not caught up on, the schedule is shifted instead so the
+    remaining steps keep their durations.
+    """
+
+    def __init__(self, name='', max_lag=0.5, smoothing=0.3, clock=None):
+        self.name = name
+        self.clock = clock or Clock()
+        self.max_lag = max_lag
+        self.smoothing = smoothing
+        self.latency = 0.0
+        self.steps = []
+        self.start = self.clock.monotonic()
+        self._deadline = self.start
+
+    def elapsed(self):
+        return self.clock.monotonic() - self.start
+
+    def shift(self, seconds):
+        """Move the remaining deadlines ``seconds`` later."""
+        self._deadline += seconds
+
+    def _plan_wait(self, seconds):
+        """Move the deadline ``seconds`` on, return the seconds to sleep."""
+        now = self.clock.monotonic()
+        lag = now - self._deadline
+        if lag > self.max_lag:
+            logger.debug(
+                '%s: %.3fs behind the plan, shifting the schedule.',
+                self.name,
+                lag,
+            )
+            self.shift(lag)
+        self._deadline += seconds
+        return self._deadline - self.latency - now
+
+    def _waited(self, name):
+        self.steps.append(
+            Step(name, self._deadline - self.start, self.elapsed())
+        )
+
+    def wait(self, seconds, name='wait'):
+        remaining = self._plan_wait(seconds)
+        if remaining > 0:
+            self.clock.sleep(remaining)
+        self._waited(name)
+
+    async def async_wait(self, seconds, name='wait'):
+        """Coroutine version of :meth:`wait`."""
+        remaining = self._plan_wait(seconds)
+        if remaining > 0:
+            await self.clock.async_sleep(remaining)
+        self._waited(name)
+
+    @contextmanager
+    def measure(self, name):
+        """Time the block as a step of the schedule, measuring its latency."""
+        planned = self._deadline - self.start
+        started = self.clock.monotonic()
+        yield
+        duration = self.clock.monotonic() - started
+        self.latency += self.smoothing * (duration - self.latency)
+        self.steps.append(Step(name, planned, started - self.start, duration))
+
+    def step(self, name, action, *args, **kwds):
+        """Run ``action`` as a step of the schedule, measuring its latency."""
+        with self.measure(name):
+            return action(*args, **kwds)
+
+    def report(self):
+        return [step.as_dict() for step in self.steps]
+
+    def log_report(self):
+        for step in self.steps:
+            logger.debug(
+                '%s: %s planned %.3fs actual %.3fs (lag %+.3fs, took %.3fs)',
+                self.name,
+                step.name,
+                step.planned,
+                step.actual,
+                step.lag,
+                step.duration,
+            )
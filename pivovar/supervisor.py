@@ -0,0 +1,89 @@
+import asyncio
+from collections import OrderedDict
+import logging
+from threading import Thread
+
+from pivovar import config as cfg
+from pivovar.jsonrpc import AsyncClient, Client
+from pivovar.wash_machine import WashMachine
+from pivovar.wash_machine_async import AsyncWashMachine
+
+
+logger = logging.getLogger('supervisor')
+SECTION_PREFIX = 'wash_machine_'
+
+
+def run_event_loop(*coros):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(asyncio.gather(*coros))
+
+
+class Supervisor(object):
+    """Runs all the wash machines configured in one process.
+
+    Every ``[wash_machine_*]`` section of the configuration becomes a
+    machine. Machines driven by the same UniPi share a single JSON-RPC
+    client, so there is one connection pool per UniPi URL.
+    """
+
+    def __init__(self, machine_cls=WashMachine):
+        self.machine_cls = machine_cls
+        self.machines = OrderedDict()
+        self._clients = {}
+        self._async_clients = {}
+
+    def client_for(self, url, **options):
+        """Return the client of ``url``, the first options given win."""
+        if url not in self._clients:
+            self._clients[url] = Client(url, **options)
+        return self._clients[url]
+
+    def async_client_for(self, url, **options):
+        if url not in self._async_clients:
+            self._async_clients[url] = AsyncClient(url, **options)
+        return self._async_clients[url]
+
+    def add(self, wm):
+        wm._unipi_jsonrpc = self.client_for(
+            wm.unipi_jsonrpc_url, **wm.rpc_options
+        )
+        if isinstance(wm, AsyncWashMachine):
+            wm._unipi_jsonrpc_async = self.async_client_for(
+                wm.unipi_jsonrpc_url, **wm.rpc_options
+            )
+        self.machines[wm.name] = wm
+
+    @classmethod
+    def from_config(cls, machine_cls=WashMachine, config=cfg):
+        self = cls(machine_cls)
+        for section in config.sections():
+            if section.startswith(SECTION_PREFIX):
+                self.add(machine_cls.from_config(section, config))
+        return self
+
+    def start(self):
+        """Start all the machines in daemon threads."""
+        for wm in self.machines.values():
+            wm.input_watcher.start()
+        if issubclass(self.machine_cls, AsyncWashMachine):
+            self._start_thread(
+                'event loop',
+                run_event_loop,
+                *(wm.run() for wm in self.machines.values())
+            )
+            return
+
+        for name, wm in self.machines.items():
+            logger.info('Starting %s.', name)
+            self._start_thread(
+                '{} temps updater'.format(name), wm.temps_update
+            )
+            self._start_thread(name, wm.wash_the_kegs)
+
+    @staticmethod
+    def _start_thread(name, target, *args):
+        thread = Thread(name=name, target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -0,0 +1,99 @@
+from array import array
+from bisect import bisect_left
+import copy
+from datetime import datetime
+import math
+import threading
+
+
+# float32 holds about 7 significant digits; do not show the noise beyond.
+TEMP_DIGITS = 3
+
+
+class TempLog(object):
+    """Fixed-size ring buffer of temperature samples.
+
+    The samples are stored in two compact columns: the times as epoch
+    seconds (float64) and the temperatures (float32), with NaN marking a
+    missing sample. Appending is O(1); once the buffer is full the oldest
+    sample gets overwritten.
+
+    ``appended`` counts all the samples ever appended, so it can be used as a
+    cursor to find the samples added since some point. The readers in other
+    threads than the appending one take a :meth:`snapshot`.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._times = array('d', [0.0]) * capacity
+        self._temps = array('f', [math.nan]) * capacity
+        self.appended = 0
+
+    def __len__(self):
+        return min(self.appended, self.capacity)
+
+    def append(self, time, temp):
+        """Append sample taken at ``time`` (epoch seconds), ``temp`` or None."""
+        with self._lock:
+            i = self.appended % self.capacity
+            self._times[i] = time
+            self._temps[i] = math.nan if temp is None else temp
+            self.appended += 1
+
+    def snapshot(self):
+        """Return a copy of the log, unchanged by the later appends."""
+        with self._lock:
+            snapshot = copy.copy(self)
+            snapshot._times = self._times[:]
+            snapshot._temps = self._temps[:]
+        snapshot._lock = threading.Lock()
+        return snapshot
+
+    @property
+    def first(self):
+        """Cursor of the oldest sample still present in the buffer."""
+        return self.appended - len(self)
+
+    def _column(self, column, start):
+        start = max(start, self.first)
+        if start >= self.appended:
+            return column[:0]
+        begin = start % self.capacity
+        end = self.appended % self.capacity
+        if begin < end:
+            return column[begin:end]
+        return column[begin:] + column[:end]
+
+    def columns(self, start=0, stop=None):
+        """Yield the ``(times, temps)`` of the samples between the cursors
+        ``start`` and ``stop``."""
+        end = self.appended if stop is None else min(stop, self.appended)
+        drop = self.appended - max(end, start)
+        times, temps = self.times(start), self.temps(start)
+        if drop:
+            times, temps = times[:-drop], temps[:-drop]
+        yield times, temps
+
+    def cursor_at(self, time):
+        """Cursor of the first sample taken at ``time`` or later."""
+        return self.first + bisect_left(self.times(), time)
+
+    def times(self, start=0):
+        """Epoch times of the samples from cursor ``start`` on."""
+        return self._column(self._times, start)
+
+    def temps(self, start=0):
+        """Temperatures (NaN for missing) of samples from cursor ``start``."""
+        return self._column(self._temps, start)
+
+    def temps_list(self, start=0):
+        """Temperatures from cursor ``start`` with None for missing."""
+        return [
+            None if math.isnan(t) else round(t, TEMP_DIGITS)
+            for t in self.temps(start)
+        ]
+
+    def __iter__(self):
+        for time, temp in zip(self.times(), self.temps_list()):
+            yield datetime.fromtimestamp(time), temp
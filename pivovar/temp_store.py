@@ -0,0 +1,234 @@
+"""Persistent store of the temperature samples.
+
+The samples are appended as fixed size records (epoch time and temperature,
+both float64, NaN for a missing temperature) to segment files in a
+directory. A new segment is started every ``segment_seconds`` and the
+segments older than ``retention_seconds`` get deleted.
+
+The segments are memory-mapped for reading, so weeks of history cost no
+Python heap. The records are ordered by time, so time ranges are found by
+binary search, and the columns are served as memoryview slices of the
+mapping without copying.
+
+The file names are the cursors of the first records of the segments, so the
+cursors stay valid across restarts of the service.
+"""
+from bisect import bisect_left
+import copy
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+
+from pivovar.temp_log import TempLog
+
+
+logger = logging.getLogger('temp_store')
+
+RECORD = struct.Struct('<dd')
+SUFFIX = '.tsd'
+
+
+class _Segment(object):
+    def __init__(self, path, base, count):
+        self.path = path
+        self.base = base
+        self.count = count
+        self._view = None
+
+    @property
+    def end(self):
+        return self.base + self.count
+
+    def view(self):
+        """Return the records as a flat float64 memoryview."""
+        view = self._view
+        if view is None or len(view) < 2 * self.count:
+            if not self.count:
+                return memoryview(b'').cast('d')
+            with open(self.path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # The old mapping is left to the garbage collector, readers may
+            # still hold views of it.
+            view = self._view = memoryview(mapping).cast('d')
+        return view[: 2 * self.count]
+
+    def frozen(self):
+        """Return a copy of the segment keeping its current records, mapped
+        already, so that it outlives the expiry of the file."""
+        segment = _Segment(self.path, self.base, self.count)
+        segment._view = self.view()
+        return segment
+
+    def times(self, lo=0, hi=None):
+        hi = self.count if hi is None else hi
+        return self.view()[2 * lo : 2 * hi : 2]
+
+    def temps(self, lo=0, hi=None):
+        hi = self.count if hi is None else hi
+        return self.view()[2 * lo + 1 : 2 * hi : 2]
+
+
+class TempStore(object):
+    """Append-only memory-mapped store with the interface of the TempLog.
+
+    ``capacity`` is the number of the latest samples served when a client
+    asks for the log without a cursor.
+    """
+
+    def __init__(
+        self,
+        path,
+        capacity,
+        retention_seconds=28 * 24 * 3600,
+        segment_seconds=24 * 3600,
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.retention_seconds = retention_seconds
+        self.segment_seconds = segment_seconds
+        self._lock = threading.Lock()
+        self._file = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._segments = self._open_segments()
+
+    def _segment_path(self, base):
+        return os.path.join(self.path, '{:012d}{}'.format(base, SUFFIX))
+
+    def _open_segments(self):
+        segments = []
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                base = int(name[: -len(SUFFIX)])
+            except ValueError:
+                continue
+            path = os.path.join(self.path, name)
+            size = os.path.getsize(path)
+            if size % RECORD.size:
+                # Partially written record of a crash.
+                logger.warning('Truncating the broken tail of %s.', path)
+                size -= size % RECORD.size
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+            segments.append(_Segment(path, base, size // RECORD.size))
+        return segments
+
+    @property
+    def appended(self):
+        segments = self._segments
+        return segments[-1].end if segments else 0
+
+    @property
+    def first(self):
+        segments = self._segments
+        return segments[0].base if segments else 0
+
+    def __len__(self):
+        return self.appended - self.first
+
+    def _start_segment(self, base):
+        if self._file is not None:
+            self._file.close()
+        segment = _Segment(self._segment_path(base), base, 0)
+        self._file = open(segment.path, 'ab')
+        self._segments = self._segments + [segment]
+        return segment
+
+    def _expire(self, time):
+        expired = [
+            segment
+            for segment in self._segments[:-1]
+            if segment.count
+            and segment.times()[-1] < time - self.retention_seconds
+        ]
+        if not expired:
+            return
+        self._segments = self._segments[len(expired) :]
+        for segment in expired:
+            logger.info(
+                'Removing expired temperature segment %s.', segment.path
+            )
+            try:
+                os.remove(segment.path)
+            except OSError as exc:
+                logger.error('Cannot remove %s: %s', segment.path, exc)
+
+    def append(self, time, temp):
+        """Append sample taken at ``time`` (epoch seconds), ``temp`` or None."""
+        record = RECORD.pack(time, math.nan if temp is None else temp)
+        with self._lock:
+            segments = self._segments
+            if not segments or (
+                segments[-1].count
+                and time - segments[-1].times()[0] >= self.segment_seconds
+            ):
+                segment = self._start_segment(self.appended)
+                self._expire(time)
+            else:
+                segment = segments[-1]
+                if self._file is None:
+                    self._file = open(segment.path, 'ab')
+            self._file.write(record)
+            self._file.flush()
+            segment.count += 1
+
+    def snapshot(self):
+        """Return a read-only copy of the store, unchanged by the later
+        appends and expiries."""
+        with self._lock:
+            snapshot = copy.copy(self)
+            snapshot._segments = [
+                segment.frozen() for segment in self._segments
+            ]
+        snapshot._lock = threading.Lock()
+        snapshot._file = None
+        return snapshot
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def columns(self, start=0, stop=None):
+        """Yield ``(times, temps)`` memoryviews of the samples between the
+        cursors ``start`` and ``stop``, one pair per segment."""
+        segments = self._segments
+        stop = self.appended if stop is None else stop
+        for segment in segments:
+            lo = max(start, segment.base) - segment.base
+            hi = min(stop, segment.end) - segment.base
+            if lo < hi:
+                yield segment.times(lo, hi), segment.temps(lo, hi)
+
+    def cursor_at(self, time):
+        """Cursor of the first sample taken at ``time`` or later."""
+        segments = [segment for segment in self._segments if segment.count]
+        starts = [segment.times()[0] for segment in segments]
+        i = bisect_left(starts, time)
+        if i == 0:
+            return self.first
+        segment = segments[i - 1]
+        return segment.base + bisect_left(segment.times(), time)
+
+    def times(self, start=0):
+        """Epoch times of the samples from cursor ``start`` on."""
+        result = []
+        for times, _ in self.columns(start):
+            result.extend(times.tolist())
+        return result
+
+    def temps(self, start=0):
+        """Temperatures (NaN for missing) of samples from cursor ``start``."""
+        result = []
+        for _, temps in self.columns(start):
+            result.extend(temps.tolist())
+        return result
+
+    temps_list = TempLog.temps_list
+    __iter__ = TempLog.__iter__
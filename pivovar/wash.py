@@ -1,32 +1,57 @@
 from __future__ import print_function
 
+import argparse
+from datetime import datetime
+from functools import wraps
 import logging
 import os
-from threading import Thread
-from flask import Flask
+import uuid
+import zlib
+from flask import Flask, Response, request
 from flask_restplus import Resource, fields
 from flask_restplus import Api
 from flask_cors import CORS
+from werkzeug.http import http_date, quote_etag
 
-from pivovar import wash_machine, configure_app
+from pivovar import metrics, wash_machine, wire_format, configure_app
+from pivovar.downsample import downsample, gather
+from pivovar.supervisor import SECTION_PREFIX, Supervisor
+from pivovar.wash_machine import WashMachine
+from pivovar.wash_machine_async import AsyncWashMachine
 
 
 logger = logging.getLogger('keg_wash')
 app = Flask(__name__)
-CORS(app)
+# The dashboard served from another port reads the metadata of the binary
+# temperature log and the ETags of the conditional requests.
+CORS(app, expose_headers=['X-Cursor', 'X-Capacity', 'X-Full', 'ETag'])
 
 
 class DefaultConfig(object):
     HOST = '0.0.0.0'
     PORT = 5001
     INSTANCE_CONFIG_FILE = 'wash.cfg'
+    # Run the wash cycle and the sampler on an asyncio event loop instead of
+    # a thread each.
+    ASYNCIO = False
 
 
 configure_app(app)
 api = Api(app)
 
 
-wash_machine = wash_machine.WashMachine.from_config('wash_machine_1')
+supervisor = Supervisor.from_config(
+    AsyncWashMachine if app.config['ASYNCIO'] else WashMachine
+)
+# The machine served by the endpoints predating the multi-machine support.
+wash_machine = next(iter(supervisor.machines.values()))
+
+
+def get_wash_machine(name):
+    try:
+        return supervisor.machines[name]
+    except KeyError:
+        api.abort(404, 'Unknown wash machine {}.'.format(name))
 
 
 washing_machine_model = api.model(
@@ -40,42 +65,310 @@ washing_machine_model = api.model(
 )
 
 
+# Plotted points of a time range when neither max_points nor resolution
+# is given.
+DEFAULT_MAX_POINTS = 1000
+
+
+def timestamp(value):
+    """Epoch seconds or a datetime in the format of the temp_log."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.strptime(
+            value, wire_format.DATETIME_FORMAT
+        ).timestamp()
+
+
+temp_log_parser = api.parser()
+temp_log_parser.add_argument(
+    'since',
+    type=int,
+    help='Cursor returned by the previous call. Only the samples added '
+    'after it are returned. Whole log is returned when omitted.',
+)
+temp_log_parser.add_argument(
+    'from',
+    type=timestamp,
+    help='Return the samples taken at this time or later, epoch seconds or '
+    'YYYY-MM-DD HH:MM:SS.',
+)
+temp_log_parser.add_argument(
+    'to', type=timestamp, help='Return the samples taken before this time.'
+)
+temp_log_parser.add_argument(
+    'max_points',
+    type=int,
+    help='Downsample to about this many points keeping the minimum and '
+    'the maximum of every time bucket.',
+)
+temp_log_parser.add_argument(
+    'format',
+    choices=wire_format.FORMATS,
+    default='datetime',
+    help='Encoding of the sample times: formatted strings, epoch seconds, '
+    'start and deltas in seconds or binary float64 times and float32 '
+    'temperatures.',
+)
+temp_log_parser.add_argument(
+    'resolution',
+    type=float,
+    help='Downsample to the minimum and the maximum of buckets of this '
+    'many seconds.',
+)
+
+
+def temp_log_response(wm):
+    args = temp_log_parser.parse_args()
+    since = args['since']
+    max_points = args['max_points']
+    # Consistent with itself however many samples are appended meanwhile.
+    temp_log = wm.temp_log.snapshot()
+    appended = temp_log.appended
+    if args['from'] is not None or args['to'] is not None:
+        full = True
+        start = temp_log.first
+        stop = appended
+        if args['from'] is not None:
+            start = temp_log.cursor_at(args['from'])
+        if args['to'] is not None:
+            stop = temp_log.cursor_at(args['to'])
+        if max_points is None:
+            max_points = DEFAULT_MAX_POINTS
+    else:
+        # Send everything when the client's cursor is unknown, outdated or
+        # comes from before a restart of the service.
+        full = since is None or not (temp_log.first <= since <= appended)
+        # Never more than the capacity of the client's plot.
+        start = max(
+            temp_log.first if full else since, appended - temp_log.capacity
+        )
+        stop = appended
+    times, temps = downsample(
+        *gather(temp_log, start, stop),
+        max_points=max_points,
+        resolution=args['resolution']
+    )
+    if args['format'] == 'binary':
+        return Response(
+            wire_format.encode_columns(times, temps),
+            mimetype=wire_format.BINARY_MIMETYPE,
+            headers={
+                'X-Cursor': str(appended),
+                'X-Capacity': str(temp_log.capacity),
+                'X-Full': '1' if full else '0',
+            },
+        )
+    response = {
+        'cursor': appended,
+        'capacity': temp_log.capacity,
+        'full': full,
+        'temps': wire_format.encode_temps(temps),
+    }
+    response.update(wire_format.encode_times(times, args['format']))
+    return response
+
+
+cycles_parser = api.parser()
+cycles_parser.add_argument(
+    'limit', type=int, default=20, help='How many recent cycles to return.'
+)
+
+
+# Tells apart the ETags of this run of the service from the previous ones.
+ETAG_PREFIX = uuid.uuid4().hex[:8]
+
+
+def conditional(event):
+    """Make a GET of the state announced by ``event`` conditional.
+
+    The responses carry an ETag and a Last-Modified made of the version of
+    the state kept by the events broker of the wash machine. A request
+    matching the ETag is answered by 304 Not Modified right away, without
+    producing nor marshalling the body. If-Modified-Since is not trusted, the
+    state changes several times within its resolution of a second.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(self, name=None, **kwds):
+            wm = wash_machine if name is None else get_wash_machine(name)
+            # Read before producing the body, a change meanwhile makes the
+            # next request get the body again.
+            version, modified = wm.events.version(event)
+            etag = '{}-{}-{}-{:x}'.format(
+                ETAG_PREFIX,
+                wm.name,
+                version,
+                zlib.crc32(request.query_string),
+            )
+            headers = {
+                'ETag': quote_etag(etag),
+                'Last-Modified': http_date(modified),
+                'Cache-Control': 'no-cache',
+            }
+            if request.if_none_match.contains_weak(etag):
+                return Response(status=304, headers=headers)
+
+            if name is not None:
+                kwds['name'] = name
+            resp = f(self, **kwds)
+            if isinstance(resp, Response):
+                resp.headers.extend(headers)
+                return resp
+            return resp, 200, headers
+
+        return wrapper
+
+    return decorator
+
+
+def cycles_response(wm):
+    limit = cycles_parser.parse_args()['limit']
+    return {
+        'stats': wm.cycle_log.stats(),
+        'cycles': wm.cycle_log.recent(limit),
+    }
+
+
+def health_response(wm):
+    return {
+        'rpc': wm.unipi_jsonrpc.health(),
+        'safety_problems': sorted(wm.safety.problems),
+    }
+
+
+def events_response(wm):
+    return Response(
+        wm.events.stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache'},
+    )
+
+
 @api.route('/temp_log')
 class RealTemps(Resource):
+    @api.expect(temp_log_parser)
+    @conditional('temp')
     def get(self):
-        return {
-            'datetime': [
-                item[0].strftime('%Y-%m-%d %H:%M:%S')
-                for item in wash_machine.temp_log
-            ],
-            'temps': [item[1] for item in wash_machine.temp_log],
-        }
+        return temp_log_response(wash_machine)
 
 
 @api.route('/wash_machine')
 class WashMachineResource(Resource):
+    @conditional('phase')
     @api.marshal_with(washing_machine_model)
     def get(self, **kwargs):
         return wash_machine
 
 
-def init():
-    wash_thread = Thread(
-        name='washing machine', target=wash_machine.wash_the_kegs
-    )
+@api.route('/wash_machines')
+class WashMachineList(Resource):
+    def get(self):
+        return list(supervisor.machines)
+
+
+@api.route('/wash_machines/<string:name>')
+class NamedWashMachineResource(Resource):
+    @conditional('phase')
+    @api.marshal_with(washing_machine_model)
+    def get(self, name):
+        return get_wash_machine(name)
+
+
+@api.route('/wash_machines/<string:name>/temp_log')
+class NamedRealTemps(Resource):
+    @api.expect(temp_log_parser)
+    @conditional('temp')
+    def get(self, name):
+        return temp_log_response(get_wash_machine(name))
+
+
+@api.route('/cycles')
+class Cycles(Resource):
+    @api.expect(cycles_parser)
+    def get(self):
+        """Phase timing of the recent keg cycles and its statistics."""
+        return cycles_response(wash_machine)
+
+
+@api.route('/wash_machines/<string:name>/cycles')
+class NamedCycles(Resource):
+    @api.expect(cycles_parser)
+    def get(self, name):
+        return cycles_response(get_wash_machine(name))
+
+
+@api.route('/health')
+class Health(Resource):
+    def get(self):
+        """State of the JSON-RPC client and of the safety inputs."""
+        return health_response(wash_machine)
 
-    temps_update_thread = Thread(
-        name='temps updater', target=wash_machine.temps_update
+
+@api.route('/wash_machines/<string:name>/health')
+class NamedHealth(Resource):
+    def get(self, name):
+        return health_response(get_wash_machine(name))
+
+
+@app.route('/events')
+def events():
+    """Server-Sent Events stream of the phase changes and new temperatures."""
+    return events_response(wash_machine)
+
+
+@app.route('/wash_machines/<string:name>/events')
+def named_events(name):
+    return events_response(get_wash_machine(name))
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """RPC, phase and sampler metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+
+@app.after_request
+def compress(response):
+    return wire_format.compress(
+        response, request.headers.get('Accept-Encoding')
     )
 
-    temps_update_thread.daemon = True
-    temps_update_thread.start()
 
-    wash_thread.daemon = True
-    wash_thread.start()
+def init():
+    supervisor.start()
+
+
+def run_dry(args):
+    from pivovar.dry_run import clock_for_speed, dry_run, format_timeline
+
+    logging.basicConfig(level=logging.INFO)
+    wm = WashMachine.from_config(
+        args.machine, clock=clock_for_speed(args.speed)
+    )
+    print(format_timeline(dry_run(wm, args.cycles)))
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Keg washing machine.')
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Run the wash cycle against simulated IO and print the timeline.',
+    )
+    parser.add_argument(
+        '--speed',
+        type=float,
+        default=0,
+        help='How many times faster the dry run goes, instantly when 0.',
+    )
+    parser.add_argument('--cycles', type=int, default=1)
+    parser.add_argument('--machine', default=SECTION_PREFIX + '1')
+    args = parser.parse_args()
+    if args.dry_run:
+        return run_dry(args)
+
     logging.basicConfig(level=logging.DEBUG)
     logging.getLogger('werkzeug').setLevel(logging.WARNING)
     use_debug = True
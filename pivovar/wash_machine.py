@@ -1,12 +1,18 @@
 import attr
+from collections import OrderedDict
 import logging
-import time
 from functools import wraps
-from datetime import datetime
 
 from pivovar import config as cfg
+from pivovar import metrics
+from pivovar.clock import Clock
+from pivovar.cycle_log import CycleLog, PhaseRecord
 import pivovar.wash_machine_io as wm_io
+from pivovar.events import EventBroker
 from pivovar.jsonrpc import Client
+from pivovar.scheduler import Schedule
+from pivovar.temp_log import TempLog
+from pivovar.temp_store import TempStore
 
 
 logger = logging.getLogger('phases')
@@ -17,21 +23,118 @@ def N_(message):
     return message
 
 
-def phase(name):
+def run_sync(coro):
+    """Run the coroutine ``coro`` to its end, return its result.
+
+    The coroutine must not suspend, which is the case of the phases of
+    :class:`WashMachine` as its IO primitives block instead.
+    """
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError('{!r} waits for an event loop.'.format(coro))
+
+
+def phase(name, outputs=None):
+    """Make the coroutine method a phase of the wash cycle.
+
+    The phase is written against the IO primitives of the machine, so it is
+    blocking on :class:`WashMachine` and a coroutine on the asynchronous
+    machine, see :meth:`WashMachine._complete`.
+
+    ``outputs`` maps the paths of the outputs under ``WashMachine.io``, as
+    ``'mv.water_or_lye'``, to the states the phase starts with, see
+    :meth:`WashMachine.prepare`.
+    """
+
     def decorator(f):
-        @wraps(f)
-        def wrapper(self, *args, **kwds):
+        async def run(self, *args, **kwds):
             self.phase_started(name)
-            ret = f(self, *args, **kwds)
+            try:
+                ret = await f(self, *args, **kwds)
+            except Exception as exc:
+                self.phase_failed(name, exc)
+                raise
             self.phase_finished(name)
             return ret
 
+        @wraps(f)
+        def wrapper(self, *args, **kwds):
+            return self._complete(run(self, *args, **kwds))
+
         wrapper.phase_name = name
+        wrapper.phase_outputs = dict(outputs or {})
         return wrapper
 
     return decorator
 
 
+class SafetyMonitor(object):
+    """Keeps the latest total stop and fuse state of a wash machine.
+
+    The state is updated by the :class:`InputWatcher` on every poll, so
+    checking it with :meth:`is_ok` costs no RPC as long as the watcher
+    keeps it fresher than ``max_age`` seconds. Older state is refreshed by
+    an inline poll before being trusted.
+    """
+
+    def __init__(self, watcher, max_age=None):
+        self.watcher = watcher
+        self._max_age = max_age
+        # Unknown until the first poll.
+        self.problems = {'Inputs have not been read yet.'}
+        watcher.listeners.append(self._update)
+
+    @property
+    def max_age(self):
+        if self._max_age is None:
+            return 4 * self.watcher.poll_seconds
+        return self._max_age
+
+    @staticmethod
+    def input_problems(states):
+        if not states:
+            return {'Inputs could not be read.'}
+        problems = set()
+        if states['total_stop']:
+            problems.add('TOTAL_STOP is pressed. Stopping the processes.')
+        if not states['fuse_ok']:
+            problems.add('No voltage on peripherals fuse. Is it blown?')
+        return problems
+
+    def _update(self, states):
+        problems = self.input_problems(states)
+        for problem in problems - self.problems:
+            logging.info(problem)
+        if self.problems and not problems:
+            logging.info('Inputs are OK.')
+        self.problems = problems
+
+    def is_fresh(self):
+        """Whether the state is recent enough to be trusted without a poll."""
+        return self.watcher.age() < self.max_age
+
+    def is_ok(self):
+        if not self.is_fresh():
+            try:
+                self.watcher.poll()
+            except Exception as exc:
+                logger.error("Couldn't check the inputs: %s", exc)
+        return not self.problems
+
+    def wait_until_ok(self):
+        """Wait as long as the inputs report a problem.
+
+        Raises :class:`InputsUnknown` when the inputs cannot be read.
+        """
+        while not self.is_ok():
+            self.watcher.wait_for(
+                lambda states: not self.problems, self.max_age
+            )
+
+
 def setdeepattr(o, path, val):
     path = path.split('.')
     for name in path[:-1]:
@@ -68,17 +171,31 @@ class WashMachine(object):
     name = attr.ib(type=str)
     required_water_temp = attr.ib(type=float, default=80.0)
     unipi_jsonrpc_url = attr.ib(type=str, default='http://localhost/rpc')
+    clock = attr.ib(default=attr.Factory(Clock))
 
     def __attrs_post_init__(self):
         self._unipi_jsonrpc = None
+        # Keyword arguments of the JSON-RPC clients.
+        self.rpc_options = {}
         self.current_phase = 'starting'
         self.errors = set()
+        self.io_cache = wm_io.ReadCache(clock=self.clock)
+        self.events = EventBroker()
+        self.schedule = Schedule(clock=self.clock)
+        # The latest schedule of each phase, to compare planned and actual
+        # timing of the steps.
+        self.schedules = {}
+        self.cycle_log = CycleLog()
+        self._phase_started = (None, None)
         self.logger = logging.getLogger('keg_wash')
-        self.temp_log = []
         # TODO Solve the problems of double init
         self.real_temp_update_seconds = 15
+        self.temp_log = TempLog(self.temp_samples_count_limit)
         self.tick_secs = 1.0
         self.heating_sleep_seconds = 5
+        self.input_poll_seconds = 0.05
+        # For how long the last state set or read of an output is trusted.
+        self.shadow_resync_seconds = 60.0
 
         self.wash_cycle = [
             self.check,
@@ -96,16 +213,32 @@ class WashMachine(object):
     @property
     def unipi_jsonrpc(self):
         if not self._unipi_jsonrpc:
-            self._unipi_jsonrpc = Client(self.unipi_jsonrpc_url)
+            self._unipi_jsonrpc = Client(
+                self.unipi_jsonrpc_url, **self.rpc_options
+            )
         return self._unipi_jsonrpc
 
     @classmethod
-    def from_config(cls, section_name):
-        wm_config = cfg[section_name]
-        self = cls(wm_config.name)
+    def from_config(cls, section_name, config=cfg, **kwds):
+        wm_config = config[section_name]
+        self = cls(wm_config.name, **kwds)
         self.init_io()
 
         self.unipi_jsonrpc_url = wm_config.get('unipi_jsonrpc_url')
+        self.rpc_options = {
+            'timeout': (
+                wm_config.getfloat('rpc_connect_timeout', fallback=1.0),
+                wm_config.getfloat('rpc_read_timeout', fallback=2.0),
+            ),
+            'retries': wm_config.getint('rpc_retries', fallback=2),
+            'failure_threshold': wm_config.getint(
+                'rpc_failure_threshold', fallback=5
+            ),
+            'reset_seconds': wm_config.getfloat(
+                'rpc_reset_seconds', fallback=5.0
+            ),
+            'pool_size': wm_config.getint('rpc_pool_size', fallback=4),
+        }
         self.required_water_temp = wm_config.getfloat('required_water_temp')
         self.heating_sleep_seconds = wm_config.getfloat(
             'heating_sleep_seconds'
@@ -114,6 +247,30 @@ class WashMachine(object):
             'realtime_temp_update_seconds'
         )
         self.tick_secs = wm_config.getfloat('tick_secs')
+        self.io_cache.ttl = wm_config.getfloat(
+            'io_cache_ttl', fallback=self.io_cache.ttl
+        )
+        self.input_watcher.poll_seconds = wm_config.getfloat(
+            'input_poll_seconds', fallback=self.input_poll_seconds
+        )
+        self.shadow_resync_seconds = wm_config.getfloat(
+            'shadow_resync_seconds', fallback=self.shadow_resync_seconds
+        )
+        self.cycle_log = CycleLog(
+            wm_config.getint('cycle_log_limit', fallback=100),
+            wm_config.get('cycle_log_path', fallback=None),
+        )
+        temp_store_path = wm_config.get('temp_store_path', fallback=None)
+        if temp_store_path:
+            self.temp_log = TempStore(
+                temp_store_path,
+                self.temp_samples_count_limit,
+                wm_config.getfloat('temp_store_retention_days', fallback=28)
+                * 24
+                * 3600,
+                wm_config.getfloat('temp_store_segment_hours', fallback=24)
+                * 3600,
+            )
 
         # TODO Resolve use of this
         # for k, v in wm_config.items():
@@ -158,6 +315,11 @@ class WashMachine(object):
         water_temp = wm_io.TemperatureSensor('water_temp', self, None)
         self.io._add(water_temp)
 
+        self.input_watcher = wm_io.InputWatcher(
+            self.io.inp.leafs, self.input_poll_seconds, self.clock
+        )
+        self.safety = SafetyMonitor(self.input_watcher)
+
     @staticmethod
     def keep_running():
         return True
@@ -168,44 +330,154 @@ class WashMachine(object):
 
     @property
     def phases(self):
+        # Including the phases of the base classes, in definition order.
+        methods = OrderedDict()
+        for cls in reversed(type(self).__mro__):
+            methods.update(vars(cls))
         return [
             v.phase_name
-            for v in vars(type(self)).values()
+            for v in methods.values()
             if getattr(v, 'phase_name', None)
         ]
 
     def phase_started(self, name):
         self.current_phase = name
+        self._phase_started = (self.clock.time(), self.clock.monotonic())
+        self.schedule = Schedule(name, clock=self.clock)
+        self.events.publish(
+            'phase',
+            {'current_phase': self.current_phase, 'time': self.clock.time()},
+        )
 
     def phase_finished(self, name):
+        self.schedule.log_report()
+        duration = self._record_phase(name)
+        metrics.PHASE_DURATION.labels(self.name, name).observe(duration)
+        self.schedules[name] = self.schedule
         self.current_phase = 'idle'
+        self.events.publish(
+            'phase',
+            {'current_phase': self.current_phase, 'time': self.clock.time()},
+        )
+
+    def phase_failed(self, name, exc):
+        self._record_phase(name, repr(exc))
+        # The failure may have left the outputs in any state.
+        self.forget_outputs()
+
+    def _record_phase(self, name, error=None):
+        started, monotonic_started = self._phase_started
+        duration = self.clock.monotonic() - monotonic_started
+        self.cycle_log.record_phase(
+            PhaseRecord(name, started, duration, error=error)
+        )
+        return duration
+
+    def cycle_started(self):
+        self.cycle_log.start_cycle(self.clock.time())
+
+    def cycle_finished(self):
+        cycle = self.cycle_log.finish_cycle(self.clock.time())
+        if cycle is not None:
+            logger.info(
+                'Keg cycle %d took %.1fs.', cycle.cycle, cycle.duration
+            )
 
     def add_temp(self, time, temp):
+        self.temp_log.append(time.timestamp(), temp)
+        cursor = self.temp_log.appended
+        self.events.publish(
+            'temp',
+            {
+                'cursor': cursor,
+                'time': time.timestamp(),
+                'datetime': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'temp': self.temp_log.temps_list(cursor - 1)[0],
+            },
+        )
         if temp is None:
-            self.temp_log.append((time, None))
             logger.info(
                 'Added missing value of wash machine water temperature'
                 'into the temp_log'
             )
         else:
-            self.temp_log.append((time, temp))
             logger.info(
                 'Added wash machine water temperature %0.1f into the temp_log',
                 temp,
             )
 
-        self.temp_log = self.temp_log[-self.temp_samples_count_limit :]
+    def observe_sampler_lag(self, previous):
+        """Account how late the sample taken now is, return the time."""
+        now = self.clock.monotonic()
+        if previous is not None:
+            metrics.SAMPLER_LAG.labels(self.name).observe(
+                max(now - previous - self.real_temp_update_seconds, 0.0)
+            )
+        return now
+
+    # The IO primitives the phases are written against. They are coroutines
+    # so that the phases run on the asynchronous machine too, but here they
+    # block and never suspend, and _complete() runs the phases to the end.
+
+    _complete = staticmethod(run_sync)
+
+    async def _call_io(self, io, method, **kwds):
+        """Call ``method`` of ``io``, as ``'turn_on'``."""
+        return getattr(io, method)(**kwds)
+
+    async def _turn_on(self, io, **kwds):
+        return await self._call_io(io, 'turn_on', **kwds)
+
+    async def _turn_off(self, io, **kwds):
+        return await self._call_io(io, 'turn_off', **kwds)
+
+    async def _read_state(self, io):
+        return await self._call_io(io, 'read_state')
+
+    async def _read_temperature(self, sensor):
+        return await self._call_io(sensor, 'read_temperature')
+
+    async def _is_defined(self, io):
+        return io.is_defined()
+
+    async def _shadow_states(self, outputs):
+        return wm_io.shadow_states(self.unipi_jsonrpc, outputs)
+
+    async def _set_states(self, outputs, value):
+        wm_io.set_states(self.unipi_jsonrpc, outputs, value)
+
+    async def _sleep(self, seconds):
+        self.clock.sleep(seconds)
+
+    async def _schedule_wait(self, seconds, name):
+        self.schedule.wait(seconds, name)
+
+    async def _wait_for_valves(self, *valves):
+        for valve in valves:
+            valve.movement.wait()
+
+    async def _blocking(self, function, *args):
+        """Call ``function`` waiting for the inputs, which blocks."""
+        return function(*args)
+
+    async def _run_phase(self, phase):
+        return phase()
 
     def temps_update(self):
+        return self._complete(self._temps_update())
+
+    async def _temps_update(self):
+        sampled = None
         while self.keep_running():
+            sampled = self.observe_sampler_lag(sampled)
             try:
-                temp = self.io.water_temp.read_temperature()
+                temp = await self._read_temperature(self.io.water_temp)
             except Exception as exc:
                 logger.exception('Error happened in the temps update: %s', exc)
-                self.add_temp(datetime.now(), None)
+                self.add_temp(self.clock.now(), None)
             else:
-                self.add_temp(datetime.now(), temp)
-            time.sleep(self.real_temp_update_seconds)
+                self.add_temp(self.clock.now(), temp)
+            await self._sleep(self.real_temp_update_seconds)
 
     def is_keg_present(self):
         return self.io.inp.keg_present.read_state()
@@ -223,92 +495,138 @@ class WashMachine(object):
         return self.io.inp.aux_wash.read_state()
 
     def main_phase_delay_coef(self):
-        if self.is_aux_wash_selected():
+        return self._complete(self._main_phase_delay_coef())
+
+    async def _main_phase_delay_coef(self):
+        if await self._read_state(self.io.inp.aux_wash):
             return 5
 
-        if self.is_50l_keg_selected():
+        if await self._read_state(self.io.inp.keg_50l):
             return 1
         else:
             return 0.75
 
     def wait_until_inputs_ok(self):
-        previous_is_total_stop_pressed = False
-        previous_is_fuse_blown = False
+        return self._complete(self._wait_until_inputs_ok())
 
-        while True:
-            retry = False
-            if self.is_total_stop_pressed():
-                if not previous_is_total_stop_pressed:
-                    logging.info(
-                        'TOTAL_STOP is pressed. Stopping the processes.'
-                    )
-                previous_is_total_stop_pressed = True
-                retry = True
-
-            if self.is_fuse_blown():
-                if not previous_is_fuse_blown:
-                    logging.info(
-                        'No voltage on peripherals fuse. Is it blown?'
-                    )
-                previous_is_fuse_blown = True
-                retry = True
-
-            if not retry:
-                break
-            time.sleep(0.1)
+    async def _wait_until_inputs_ok(self):
+        await self._blocking(self.safety.wait_until_ok)
 
     def delay(self, ticks):
-        time.sleep(ticks * self.tick_secs)
-        self.wait_until_inputs_ok()
+        return self._complete(self._delay(ticks))
+
+    async def _delay(self, ticks):
+        await self._schedule_wait(
+            ticks * self.tick_secs, 'delay {}'.format(ticks)
+        )
+        await self._wait_until_inputs_ok()
 
     def is_temp_ok(self, temp):
         return float(temp) >= self.required_water_temp
 
+    def wait_for_valves(self, *valves):
+        """Wait until the ``valves`` finish their moves, if any."""
+        return self._complete(self._wait_for_valves(*valves))
+
     def system_flush(self, ticks):
-        self.io.mv.drain_or_recirculation.turn_to_drain()
-        self.io.rly.drain.turn_on()
-        self.io.rly.air.turn_on()
-        self.delay(ticks)
-        self.io.rly.air.turn_off()
+        return self._complete(self._system_flush(ticks))
+
+    async def _system_flush(self, ticks):
+        mv = self.io.mv.drain_or_recirculation
+        await self._call_io(mv, 'turn_to_drain', wait=False)
+        await self._turn_on(self.io.rly.drain)
+        await self._wait_for_valves(mv)
+        await self._turn_on(self.io.rly.air)
+        await self._delay(ticks)
+        await self._turn_off(self.io.rly.air)
 
     def pulse(self, io, count, duration, duty_cycle=0.5):
+        return self._complete(self._pulse(io, count, duration, duty_cycle))
+
+    async def _pulse(self, io, count, duration, duty_cycle=0.5):
         i = 0
         period = float(duration) / count
         t_on = period * duty_cycle
         t_off = period * (1 - duty_cycle)
         while True:
             i += 1
-            io.turn_on()
-            self.delay(t_on)
-            io.turn_off()
+            with self.schedule.measure('{} on'.format(io.name)):
+                await self._turn_on(io)
+            await self._delay(t_on)
+            with self.schedule.measure('{} off'.format(io.name)):
+                await self._turn_off(io)
             if i >= count:
                 break
-            self.delay(t_off)
+            await self._delay(t_off)
 
     @phase(N_("reset"))
-    def reset(self):
-        self.io.out.waiting_for_input_lamp.turn_off()
-        rlys_to_switch = (
-            rly for rly in self.io.rly.all_leafs() if rly.read_state()
-        )
-        for rly in rlys_to_switch:
-            rly.turn_off()
-
+    async def reset(self):
+        rlys = list(self.io.rly.all_leafs())
+        valves = list(self.io.mv.all_leafs())
+        states = await self._shadow_states(rlys + valves)
+        rlys_to_switch = [rly for rly, on in zip(rlys, states) if on]
         valves_to_switch = [
-            mv for mv in self.io.mv.all_leafs() if mv.read_state()
+            mv for mv, on in zip(valves, states[len(rlys) :]) if on
         ]
-        if any(valves_to_switch):
-            for mv in self.io.mv.all_leafs():
-                mv.turn_off(wait=False)
 
-            wait_time = max(mv.transition_time for mv in valves_to_switch)
-            time.sleep(wait_time)
+        to_switch = [self.io.out.waiting_for_input_lamp] + rlys_to_switch
+        if valves_to_switch:
+            to_switch.extend(valves)
+        await self._set_states(to_switch, False)
+        # The phases wait for the valves they need.
+        for mv in valves_to_switch:
+            mv.started_move()
+
+    def planned_outputs(self):
+        """Return the outputs switched by :meth:`prepare`: the relays, the
+        motor valves and the lamp waiting for the input."""
+        valves = list(self.io.mv.all_leafs())
+        aliases = [mv.alias for mv in valves]
+        rlys = [
+            rly for rly in self.io.rly.all_leafs() if rly.alias not in aliases
+        ]
+        return rlys + [self.io.out.waiting_for_input_lamp] + valves
+
+    def required_states(self, phase, outputs):
+        """Return the states of the ``outputs`` ``phase`` starts with.
+
+        The outputs not declared by the phase are off, which is the safe
+        position of the motor valves too: water, not lye, and drain.
+        """
+        declared = dict(getattr(phase, 'phase_outputs', {}))
+        return [
+            declared.get(io.conf_key.split('.', 1)[1], False) for io in outputs
+        ]
+
+    def prepare(self, phase):
+        """Switch only the outputs whose state differs from the one
+        ``phase`` starts with.
+
+        The states are taken from the shadows of the outputs, so usually
+        nothing is read. The motor valves are not waited for, the phases
+        wait for the ones they need.
+        """
+        return self._complete(self._prepare(phase))
+
+    async def _prepare(self, phase):
+        outputs = self.planned_outputs()
+        states = await self._shadow_states(outputs)
+        to_turn_on, to_turn_off = wm_io.plan_transition(
+            outputs, states, self.required_states(phase, outputs)
+        )
+        if to_turn_off:
+            await self._set_states(to_turn_off, False)
+        if to_turn_on:
+            await self._set_states(to_turn_on, True)
+        for io in to_turn_on + to_turn_off:
+            if isinstance(io, wm_io.MotorValve):
+                io.started_move()
 
     @phase(N_('check'))
-    def check(self):
+    async def check(self):
         failed = []
         for io in self.io.all_leafs():
-            if not io.is_defined():
+            if not await self._is_defined(io):
                 failed.append(io)
 
         if failed:
@@ -318,18 +636,24 @@ class WashMachine(object):
                 )
             )
 
-    @phase(N_('waiting for keg'))
-    def wait_for_keg(self):
+    def wait_until_keg_present(self):
+        """Wait for a keg, failing only when the inputs cannot be read."""
+        while not self.input_watcher.wait_for(
+            lambda states: states['keg_present'] and not self.safety.problems,
+            self.safety.max_age,
+        ):
+            pass
+
+    @phase(N_('waiting for keg'), {'out.waiting_for_input_lamp': True})
+    async def wait_for_keg(self):
         logging.info('Waiting for keg.')
-        self.io.out.waiting_for_input_lamp.turn_on()
-        while not self.is_keg_present():
-            time.sleep(0.01)
-            self.wait_until_inputs_ok()
-
-    @phase(N_('heating'))
-    def heating(self):
-        actual_temp = self.io.water_temp.read_temperature()
-        self.io.out.waiting_for_input_lamp.turn_on()
+        await self._turn_on(self.io.out.waiting_for_input_lamp)
+        await self._blocking(self.wait_until_keg_present)
+
+    @phase(N_('heating'), {'out.waiting_for_input_lamp': True})
+    async def heating(self):
+        actual_temp = await self._read_temperature(self.io.water_temp)
+        await self._turn_on(self.io.out.waiting_for_input_lamp)
         while not self.is_temp_ok(actual_temp):
             logging.info(
                 'Waiting for water (actual temperature %.2f) '
@@ -337,75 +661,95 @@ class WashMachine(object):
                 actual_temp,
                 self.required_water_temp,
             )
-            time.sleep(self.heating_sleep_seconds)
-            actual_temp = self.io.water_temp.read_temperature()
+            await self._sleep(self.heating_sleep_seconds)
+            actual_temp = await self._read_temperature(self.io.water_temp)
         logging.info(
             'Water ready (actual temperature %.2f. Required %.2f)',
             actual_temp,
             self.required_water_temp,
         )
-        self.wait_until_inputs_ok()
-
-    @phase(N_('prewashing'))
-    def prewash(self):
-        self.pulse(self.io.rly.cold_water, 5, 30, 0.8)
-
-    @phase(N_('draining'))
-    def drain(self):
-        self.io.mv.drain_or_recirculation.turn_to_drain()
-        self.io.rly.drain.turn_on()
-        self.io.rly.air.turn_on()
-        self.delay(5 * self.main_phase_delay_coef())
-        self.io.rly.air.turn_off()
-        self.io.rly.drain.turn_off()
-
-    @phase(N_('washing with lye'))
-    def wash_with_lye(self):
-        self.io.mv.water_or_lye.turn_to_lye()
-        self.io.rly.pump.turn_on()
-        self.delay(50 * self.main_phase_delay_coef())
-        self.io.rly.pump.turn_off()
-        self.io.mv.water_or_lye.turn_to_water()
-
-    @phase(N_('washing with cold water'))
-    def rinse_with_cold_water(self):
-        self.io.mv.drain_or_recirculation.turn_to_recirculation()
-        self.io.rly.cold_water.turn_on()
-        self.delay(30 * self.main_phase_delay_coef())
-        self.io.rly.cold_water.turn_off()
-        self.io.mv.drain_or_recirculation.turn_to_drain()
-        self.system_flush(1)
-
-    @phase(N_('washing with hot water'))
-    def wash_with_hot_water(self):
-        self.io.mv.drain_or_recirculation.turn_to_recirculation()
-        self.io.rly.pump.turn_on()
-        self.delay(30 * self.main_phase_delay_coef())
-        self.io.rly.pump.turn_off()
-        self.io.mv.drain_or_recirculation.turn_to_drain()
-
-    @phase(N_('drying'))
-    def dry(self):
-        self.io.mv.drain_or_recirculation.turn_to_drain()
-        self.io.rly.air.turn_on()
-        self.delay(30 * self.main_phase_delay_coef())
-        self.io.rly.air.turn_off()
-        self.io.rly.drain.turn_off()
+        await self._wait_until_inputs_ok()
+
+    @phase(N_('prewashing'), {'mv.drain_or_recirculation': False})
+    async def prewash(self):
+        await self._wait_for_valves(self.io.mv.drain_or_recirculation)
+        await self._pulse(self.io.rly.cold_water, 5, 30, 0.8)
+
+    @phase(N_('draining'), {'mv.drain_or_recirculation': False})
+    async def drain(self):
+        mv = self.io.mv.drain_or_recirculation
+        await self._call_io(mv, 'turn_to_drain', wait=False)
+        await self._turn_on(self.io.rly.drain)
+        await self._wait_for_valves(mv)
+        await self._turn_on(self.io.rly.air)
+        await self._delay(5 * await self._main_phase_delay_coef())
+        await self._turn_off(self.io.rly.air)
+        await self._turn_off(self.io.rly.drain)
+
+    @phase(
+        N_('washing with lye'),
+        {'mv.water_or_lye': True, 'mv.drain_or_recirculation': False},
+    )
+    async def wash_with_lye(self):
+        await self._call_io(self.io.mv.water_or_lye, 'turn_to_lye', wait=False)
+        await self._wait_for_valves(
+            self.io.mv.water_or_lye, self.io.mv.drain_or_recirculation
+        )
+        await self._turn_on(self.io.rly.pump)
+        await self._delay(50 * await self._main_phase_delay_coef())
+        await self._turn_off(self.io.rly.pump)
+
+    @phase(N_('washing with cold water'), {'mv.drain_or_recirculation': True})
+    async def rinse_with_cold_water(self):
+        mv = self.io.mv.drain_or_recirculation
+        await self._call_io(mv, 'turn_to_recirculation', wait=False)
+        await self._wait_for_valves(mv)
+        await self._turn_on(self.io.rly.cold_water)
+        await self._delay(30 * await self._main_phase_delay_coef())
+        await self._turn_off(self.io.rly.cold_water)
+        await self._system_flush(1)
+
+    @phase(
+        N_('washing with hot water'),
+        {'mv.water_or_lye': False, 'mv.drain_or_recirculation': True},
+    )
+    async def wash_with_hot_water(self):
+        mv = self.io.mv
+        await self._call_io(mv.water_or_lye, 'turn_to_water', wait=False)
+        await self._call_io(
+            mv.drain_or_recirculation, 'turn_to_recirculation', wait=False
+        )
+        await self._wait_for_valves(mv.water_or_lye, mv.drain_or_recirculation)
+        await self._turn_on(self.io.rly.pump)
+        await self._delay(30 * await self._main_phase_delay_coef())
+        await self._turn_off(self.io.rly.pump)
+
+    @phase(N_('drying'), {'mv.drain_or_recirculation': False})
+    async def dry(self):
+        await self._call_io(self.io.mv.drain_or_recirculation, 'turn_to_drain')
+        await self._turn_on(self.io.rly.air)
+        await self._delay(30 * await self._main_phase_delay_coef())
+        await self._turn_off(self.io.rly.air)
+        await self._turn_off(self.io.rly.drain)
 
     @phase(N_('filling with CO2'))
-    def fill_with_co2(self):
-        self.io.rly.co2.turn_on()
-        self.delay(10 * self.main_phase_delay_coef())
-        self.io.rly.co2.turn_off()
+    async def fill_with_co2(self):
+        await self._turn_on(self.io.rly.co2)
+        await self._delay(10 * await self._main_phase_delay_coef())
+        await self._turn_off(self.io.rly.co2)
 
     def wash_the_kegs(self):
+        return self._complete(self._wash_the_kegs())
+
+    async def _wash_the_kegs(self):
         while self.keep_running():
+            self.cycle_started()
             for phase in self.wash_cycle:
                 while self.keep_repeating():
                     try:
-                        self.signal_error(False)
-                        self.reset()
-                        phase()
+                        await self._signal_error(False)
+                        await self._prepare(phase)
+                        await self._run_phase(phase)
                         break
                     except Exception as exc:
                         logger.exception(
@@ -413,14 +757,27 @@ class WashMachine(object):
                             phase.phase_name,
                             exc,
                         )
-                        self.signal_error(True)
-                        time.sleep(ERROR_SLEEP_TIME)
+                        # Also when the failure was outside of the phase.
+                        self.forget_outputs()
+                        await self._signal_error(True)
+                        await self._sleep(ERROR_SLEEP_TIME)
+            self.cycle_finished()
+
+    def forget_outputs(self):
+        """Drop the shadows of the outputs, so the next prepare or reset
+        reads them."""
+        for group in (self.io.rly, self.io.out, self.io.mv):
+            for io in group.leafs:
+                io.forget()
 
     def signal_error(self, error=True):
+        return self._complete(self._signal_error(error))
+
+    async def _signal_error(self, error=True):
         try:
             if error:
-                self.io.out.error_lamp.turn_on()
+                await self._turn_on(self.io.out.error_lamp)
             else:
-                self.io.out.error_lamp.turn_off()
+                await self._turn_off(self.io.out.error_lamp)
         except Exception as exc:
             logger.exception("Couldn't switch the error lamp: %s", exc)
@@ -0,0 +1,91 @@
+import asyncio
+from functools import partial
+import logging
+
+import pivovar.wash_machine_io as wm_io
+from pivovar.jsonrpc import AsyncClient, ProtocolError
+from pivovar.wash_machine import WashMachine
+
+
+logger = logging.getLogger('phases')
+
+
+class AsyncWashMachine(WashMachine):
+    """Wash machine driven by an asyncio event loop.
+
+    The phases of :class:`WashMachine` run as coroutines on the IO
+    primitives of this class, which use the
+    :class:`pivovar.jsonrpc.AsyncClient`, so any number of machines and
+    their temperature samplers can share a single event loop::
+
+        loop.run_until_complete(asyncio.gather(wm1.run(), wm2.run()))
+
+    The inputs are checked by the :class:`SafetyMonitor` from the state of
+    the :class:`pivovar.wash_machine_io.InputWatcher`, started by the
+    supervisor, and waited for in an executor thread when not OK.
+    """
+
+    def __attrs_post_init__(self):
+        super(AsyncWashMachine, self).__attrs_post_init__()
+        self._unipi_jsonrpc_async = None
+
+    @property
+    def unipi_jsonrpc_async(self):
+        if not self._unipi_jsonrpc_async:
+            self._unipi_jsonrpc_async = AsyncClient(
+                self.unipi_jsonrpc_url, **self.rpc_options
+            )
+        return self._unipi_jsonrpc_async
+
+    async def run(self):
+        await asyncio.gather(self.wash_the_kegs(), self.temps_update())
+
+    @staticmethod
+    def _complete(coro):
+        return coro
+
+    async def _call_io(self, io, method, **kwds):
+        return await getattr(io, 'async_' + method)(**kwds)
+
+    async def _is_defined(self, io):
+        logger.info('Checking whether %s exists.', io)
+        try:
+            if isinstance(io, wm_io.TemperatureSensor):
+                await io.async_read_temperature()
+            else:
+                await io.async_read_state()
+            return True
+        except (ProtocolError, wm_io.LostSensor):
+            logger.error('IO %s not found in UniPi!', io)
+            return False
+
+    async def _shadow_states(self, outputs):
+        return await wm_io.async_shadow_states(
+            self.unipi_jsonrpc_async, outputs
+        )
+
+    async def _set_states(self, outputs, value):
+        await wm_io.async_set_states(self.unipi_jsonrpc_async, outputs, value)
+
+    async def _sleep(self, seconds):
+        await self.clock.async_sleep(seconds)
+
+    async def _schedule_wait(self, seconds, name):
+        await self.schedule.async_wait(seconds, name)
+
+    async def _wait_for_valves(self, *valves):
+        for valve in valves:
+            await valve.movement.async_wait()
+
+    async def _blocking(self, function, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, partial(function, *args))
+
+    async def _wait_until_inputs_ok(self):
+        # No thread hop while the watcher keeps the state fresh and OK.
+        if self.safety.is_fresh() and not self.safety.problems:
+            return
+        await super(AsyncWashMachine, self)._wait_until_inputs_ok()
+
+    async def _run_phase(self, phase):
+        return await phase()
@@ -4,8 +4,9 @@ from collections import namedtuple
 import logging
 import re
 from pivovar import PivovarError
+from pivovar.clock import Clock
 from pivovar.jsonrpc import ProtocolError
-import time
+import threading
 
 
 logger = logging.getLogger('wash_machine_io')
@@ -37,6 +38,20 @@ class UniPiIO(StructureNode):
     def _get_unipi_jsonrpc(self):
         return self._facility.unipi_jsonrpc
 
+    def _read(self, method, arg):
+        return self._facility.io_cache.read(
+            self._get_unipi_jsonrpc(), method, arg
+        )
+
+    def _invalidate(self):
+        self._facility.io_cache.invalidate()
+
+    def _get_unipi_jsonrpc_async(self):
+        return self._facility.unipi_jsonrpc_async
+
+    async def _async_read(self, method, arg):
+        return await getattr(self._get_unipi_jsonrpc_async(), method)(arg)
+
     @abstractmethod
     def is_defined(self):
         pass
@@ -54,6 +69,12 @@ class UniPiReadable(UniPiIO):
     def read_state(self):
         pass
 
+    def _read_request(self, rpc):
+        return getattr(rpc, self._read_method)(self.alias)
+
+    def _observed(self, state):
+        """Called with every state read from the UniPi."""
+
     def is_defined(self):
         logger.info('Checking whether %s exists.', self)
         try:
@@ -69,21 +90,102 @@ class UniPiReadable(UniPiIO):
 
 
 class Switchable(UniPiReadable):
+    """Relay or digital output.
+
+    The last state set or read is kept as the ``shadow``. Setting the state
+    the shadow already holds sends nothing. The shadow is trusted for the
+    ``shadow_resync_seconds`` of the facility, the first write or
+    :func:`shadow_states` after that goes to the UniPi again. A failed write
+    forgets the shadow.
+    """
+
+    _read_method = 'relay_get'
+
+    def __attrs_post_init__(self):
+        super(Switchable, self).__attrs_post_init__()
+        self.forget()
+
+    def forget(self):
+        """Drop the shadow, the next write is sent whatever it is."""
+        self.shadow = None
+        self._shadow_taken = None
+
+    def _observed(self, state):
+        self.shadow = bool(state)
+        self._shadow_taken = self._facility.clock.monotonic()
+
+    def is_shadow_fresh(self):
+        return (
+            self.shadow is not None
+            and self._facility.clock.monotonic() - self._shadow_taken
+            < self._facility.shadow_resync_seconds
+        )
+
+    def _is_set_to(self, value):
+        return self.is_shadow_fresh() and self.shadow == bool(value)
+
     def _set(self, value):
+        """Set the relay to ``value``, return whether anything was sent."""
+        if self._is_set_to(value):
+            logger.debug("%s is already '%s'", self, value)
+            return False
         logger.debug("Setting %s to '%s'", self, value)
-        self._get_unipi_jsonrpc().relay_set(self.alias, value)
+        self.forget()
+        try:
+            self._get_unipi_jsonrpc().relay_set(self.alias, value)
+        finally:
+            # After the write, so no read overlapping it is kept.
+            self._invalidate()
+        self._observed(value)
+        return True
 
     def turn_on(self):
-        self._set(True)
+        return self._set(True)
 
     def turn_off(self):
-        self._set(False)
+        return self._set(False)
+
+    def _parse_state(self, value):
+        return value[0]
 
     def read_state(self):
         try:
-            return self._get_unipi_jsonrpc().relay_get(self.alias)[0]
+            state = self._parse_state(
+                self._read(self._read_method, self.alias)
+            )
+        except ProtocolError as exc:
+            raise PivovarError("Couldn't read {}: {}".format(self, exc))
+        self._observed(state)
+        return state
+
+    async def _async_set(self, value):
+        if self._is_set_to(value):
+            logger.debug("%s is already '%s'", self, value)
+            return False
+        logger.debug("Setting %s to '%s'", self, value)
+        self.forget()
+        try:
+            await self._get_unipi_jsonrpc_async().relay_set(self.alias, value)
+        finally:
+            self._invalidate()
+        self._observed(value)
+        return True
+
+    async def async_turn_on(self):
+        return await self._async_set(True)
+
+    async def async_turn_off(self):
+        return await self._async_set(False)
+
+    async def async_read_state(self):
+        try:
+            state = self._parse_state(
+                await self._async_read(self._read_method, self.alias)
+            )
         except ProtocolError as exc:
             raise PivovarError("Couldn't read {}: {}".format(self, exc))
+        self._observed(state)
+        return state
 
 
 @attr.s
@@ -91,17 +193,24 @@ class TemperatureSensor(UniPiIO):
     address = attr.ib(type=str)
 
     def _get(self):
-        return OneWireSensor(
-            *self._get_unipi_jsonrpc().sensor_get(self.address)
-        )
+        return OneWireSensor(*self._read('sensor_get', self.address))
 
     def is_lost(self):
         return self._get().lost
 
     def read_temperature(self):
-        if self.is_lost():
+        sensor = self._get()
+        if sensor.lost:
             raise LostSensor('Sensor {} has been lost.'.format(self))
-        return self._get().value
+        return sensor.value
+
+    async def async_read_temperature(self):
+        sensor = OneWireSensor(
+            *await self._async_read('sensor_get', self.address)
+        )
+        if sensor.lost:
+            raise LostSensor('Sensor {} has been lost.'.format(self))
+        return sensor.value
 
     def is_defined(self):
         logger.info('Checking %s exists.', self)
@@ -125,26 +234,110 @@ class TemperatureSensor(UniPiIO):
 
 
 class Input(UniPiReadable):
+    _read_method = 'input_get_value'
+
+    def _parse_state(self, value):
+        return value
+
     def read_state(self):
-        return self._get_unipi_jsonrpc().input_get_value(self.alias)
+        return self._parse_state(self._read(self._read_method, self.alias))
+
+    async def async_read_state(self):
+        return self._parse_state(
+            await self._async_read(self._read_method, self.alias)
+        )
+
+
+class Actuation(object):
+    """Completion handle of a :class:`MotorValve` move, done at the
+    ``done_at`` monotonic time of the clock of the valve."""
+
+    def __init__(self, valve, done_at):
+        self.valve = valve
+        self.done_at = done_at
+
+    def remaining(self):
+        """Seconds until the valve gets to the position."""
+        now = self.valve._facility.clock.monotonic()
+        return max(self.done_at - now, 0.0)
+
+    def done(self):
+        return not self.remaining()
+
+    def wait(self):
+        remaining = self.remaining()
+        if remaining:
+            self.valve._facility.clock.sleep(remaining)
+
+    async def async_wait(self):
+        remaining = self.remaining()
+        if remaining:
+            await self.valve._facility.clock.async_sleep(remaining)
 
 
 @attr.s
 class MotorValve(Switchable):
+    """Valve driven by a motor, getting to the position set by the relay in
+    ``transition_time``.
+
+    The moves return their :class:`Actuation`, so the independent steps can
+    go on while the valve moves, waiting for it only where it is needed.
+    """
+
     transition_time = attr.ib(type=float, default=3.0)
 
-    def turn_on(self, wait=True):
-        super(MotorValve, self).turn_on()
+    def __attrs_post_init__(self):
+        super(MotorValve, self).__attrs_post_init__()
+        self._moving_until = float('-inf')
+
+    @property
+    def movement(self):
+        """:class:`Actuation` of the last move of the valve."""
+        return Actuation(self, self._moving_until)
+
+    def started_move(self):
+        """Record the relay has just been switched, return the
+        :class:`Actuation` of the move."""
+        self._moving_until = (
+            self._facility.clock.monotonic() + self.transition_time
+        )
+        return self.movement
+
+    def _moved(self, moved, wait):
+        actuation = self.started_move() if moved else self.movement
         if wait:
-            self.wait_for_valve_to_switch()
+            actuation.wait()
+        return actuation
+
+    def turn_on(self, wait=True):
+        """Return the :class:`Actuation` of the move, already done unless
+        ``wait`` is False."""
+        return self._moved(super(MotorValve, self).turn_on(), wait)
 
     def turn_off(self, wait=True):
-        super(MotorValve, self).turn_off()
-        if wait:
-            self.wait_for_valve_to_switch()
+        return self._moved(super(MotorValve, self).turn_off(), wait)
 
     def wait_for_valve_to_switch(self):
-        time.sleep(self.transition_time)
+        self.movement.wait()
+
+    async def _async_moved(self, moved, wait):
+        actuation = self.started_move() if moved else self.movement
+        if wait:
+            await actuation.async_wait()
+        return actuation
+
+    async def async_turn_on(self, wait=True):
+        return await self._async_moved(
+            await super(MotorValve, self).async_turn_on(), wait
+        )
+
+    async def async_turn_off(self, wait=True):
+        return await self._async_moved(
+            await super(MotorValve, self).async_turn_off(), wait
+        )
+
+    async def async_wait_for_valve_to_switch(self):
+        await self.movement.async_wait()
 
     def _read_config(self, section):
         super(MotorValve, self)._read_config(section)
@@ -155,18 +348,30 @@ class MotorValve(Switchable):
 
 class DrainOrRecirculation(MotorValve):
     def turn_to_drain(self, wait=True):
-        self.turn_off(wait)
+        return self.turn_off(wait)
 
     def turn_to_recirculation(self, wait=True):
-        self.turn_on(wait)
+        return self.turn_on(wait)
+
+    async def async_turn_to_drain(self, wait=True):
+        return await self.async_turn_off(wait)
+
+    async def async_turn_to_recirculation(self, wait=True):
+        return await self.async_turn_on(wait)
 
 
 class WaterOrLye(MotorValve):
     def turn_to_water(self, wait=True):
-        self.turn_off(wait)
+        return self.turn_off(wait)
 
     def turn_to_lye(self, wait=True):
-        self.turn_on(wait)
+        return self.turn_on(wait)
+
+    async def async_turn_to_water(self, wait=True):
+        return await self.async_turn_off(wait)
+
+    async def async_turn_to_lye(self, wait=True):
+        return await self.async_turn_on(wait)
 
 
 @attr.s
@@ -208,9 +413,346 @@ class IOGroup(StructureNode):
         io.parent = io.parent if io.parent else self
 
 
+def read_states(rpc, ios):
+    """Read the states of Switchables or Inputs using a single batch call."""
+    ios = list(ios)
+    with rpc.batch() as batch:
+        calls = [io._read_request(batch) for io in ios]
+    return _parse_states(ios, calls)
+
+
+def _parse_states(ios, calls):
+    states = []
+    for io, call in zip(ios, calls):
+        try:
+            state = io._parse_state(call.result())
+        except ProtocolError as exc:
+            raise PivovarError("Couldn't read {}: {}".format(io, exc))
+        io._observed(state)
+        states.append(state)
+    return states
+
+
+def _unknown(switchables):
+    """Return which of the ``switchables`` have no fresh shadow."""
+    return [not io.is_shadow_fresh() for io in switchables]
+
+
+def _merge_shadows(switchables, unknown, read):
+    read = iter(read)
+    return [
+        next(read) if is_unknown else io.shadow
+        for io, is_unknown in zip(switchables, unknown)
+    ]
+
+
+def shadow_states(rpc, switchables):
+    """Return the states of the ``switchables``, reading in a single batch
+    call only the ones without a fresh shadow."""
+    switchables = list(switchables)
+    unknown = _unknown(switchables)
+    read = read_states(rpc, [io for io, u in zip(switchables, unknown) if u])
+    return _merge_shadows(switchables, unknown, read)
+
+
+def plan_transition(outputs, states, required):
+    """Return the ``(to_turn_on, to_turn_off)`` lists of the ``outputs``
+    to switch from their current ``states`` to the ``required`` ones.
+
+    ``states`` and ``required`` are in the order of the ``outputs``, a
+    required state of None keeps the output as it is.
+    """
+    to_turn_on = []
+    to_turn_off = []
+    for io, state, wanted in zip(outputs, states, required):
+        if wanted is None or bool(state) == wanted:
+            continue
+        (to_turn_on if wanted else to_turn_off).append(io)
+    return to_turn_on, to_turn_off
+
+
+def _to_set(switchables, value):
+    return [io for io in switchables if not io._is_set_to(value)]
+
+
+def _confirm_set(switchables, calls, value):
+    for io, call in zip(switchables, calls):
+        try:
+            call.result()
+        except ProtocolError as exc:
+            raise PivovarError("Couldn't set {}: {}".format(io, exc))
+        io._observed(value)
+
+
+def set_states(rpc, switchables, value):
+    """Set all the ``switchables`` to ``value`` using a single batch call.
+
+    The ones already in the state by their shadow are skipped.
+    """
+    switchables = _to_set(switchables, value)
+    if not switchables:
+        return
+    logger.debug(
+        "Setting %s to '%s'", ', '.join(str(io) for io in switchables), value
+    )
+    for io in switchables:
+        io.forget()
+    try:
+        with rpc.batch() as batch:
+            calls = [batch.relay_set(io.alias, value) for io in switchables]
+    finally:
+        for io in switchables:
+            io._invalidate()
+    _confirm_set(switchables, calls, value)
+
+
+async def async_read_states(rpc, ios):
+    """Coroutine version of :func:`read_states`."""
+    ios = list(ios)
+    async with rpc.batch() as batch:
+        calls = [io._read_request(batch) for io in ios]
+    return _parse_states(ios, calls)
+
+
+async def async_shadow_states(rpc, switchables):
+    """Coroutine version of :func:`shadow_states`."""
+    switchables = list(switchables)
+    unknown = _unknown(switchables)
+    read = await async_read_states(
+        rpc, [io for io, u in zip(switchables, unknown) if u]
+    )
+    return _merge_shadows(switchables, unknown, read)
+
+
+async def async_set_states(rpc, switchables, value):
+    """Coroutine version of :func:`set_states`."""
+    switchables = _to_set(switchables, value)
+    if not switchables:
+        return
+    logger.debug(
+        "Setting %s to '%s'", ', '.join(str(io) for io in switchables), value
+    )
+    for io in switchables:
+        io.forget()
+    try:
+        async with rpc.batch() as batch:
+            calls = [batch.relay_set(io.alias, value) for io in switchables]
+    finally:
+        for io in switchables:
+            io._invalidate()
+    _confirm_set(switchables, calls, value)
+
+
+class ReadCache(object):
+    """Answers the UniPi reads of a facility from a shared snapshot.
+
+    The snapshot is considered fresh for ``ttl`` seconds. When a read misses,
+    every read seen so far is refreshed in a single batch call, so the
+    facility's IOs cost one round-trip per ``ttl``. The lock is not held
+    during the call, the reads missing meanwhile wait for the refresh in
+    flight. Writes invalidate the snapshot, also the one being refreshed.
+    With ``ttl`` of 0 the cache is bypassed.
+    """
+
+    def __init__(self, ttl=0.0, clock=None):
+        self.ttl = ttl
+        self.clock = clock or Clock()
+        self._lock = threading.Lock()
+        self._keys = []
+        self._snapshot = {}
+        self._taken = None
+        # Set once the refresh in flight, if any, finishes.
+        self._refreshed = None
+        # Counts the invalidations, a refresh overlapping one is not fresh.
+        self._generation = 0
+
+    def _is_fresh(self):
+        return (
+            self._taken is not None
+            and self.clock.monotonic() - self._taken < self.ttl
+        )
+
+    def read(self, rpc, method, arg):
+        if not self.ttl:
+            return getattr(rpc, method)(arg)
+
+        key = (method, arg)
+        while True:
+            with self._lock:
+                if key in self._snapshot and self._is_fresh():
+                    call = self._snapshot[key]
+                    break
+                if key not in self._keys:
+                    self._keys.append(key)
+                refreshed = self._refreshed
+                refreshing = refreshed is None
+                if refreshing:
+                    refreshed = self._refreshed = threading.Event()
+                    keys = list(self._keys)
+                    generation = self._generation
+            if refreshing:
+                self._refresh(rpc, keys, generation, refreshed)
+            else:
+                refreshed.wait()
+        return call.result()
+
+    def _refresh(self, rpc, keys, generation, refreshed):
+        try:
+            with rpc.batch() as batch:
+                calls = [getattr(batch, m)(arg) for m, arg in keys]
+            with self._lock:
+                self._snapshot = dict(zip(keys, calls))
+                if generation == self._generation:
+                    self._taken = self.clock.monotonic()
+        finally:
+            with self._lock:
+                self._refreshed = None
+            refreshed.set()
+
+    def invalidate(self):
+        with self._lock:
+            self._taken = None
+            self._generation += 1
+
+
+class InputWatcher(object):
+    """Polls digital inputs of a facility using a single batch call.
+
+    Once started, a background thread keeps the latest states in ``states``
+    (keyed by the input names) fresh, polling every ``poll_seconds``. The
+    phases block on :meth:`wait_for` instead of reading the inputs one by
+    one. When the thread is not running, the waiting polls inline at the
+    same rate.
+    """
+
+    def __init__(self, inputs, poll_seconds=0.05, clock=None):
+        self.inputs = list(inputs)
+        self.poll_seconds = poll_seconds
+        self.clock = clock or Clock()
+        self.states = {}
+        self.updated = None
+        # Exception of the last poll, None when it succeeded.
+        self.error = None
+        self.listeners = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _read_inputs(self):
+        return read_states(self.inputs[0]._get_unipi_jsonrpc(), self.inputs)
+
+    def poll(self):
+        try:
+            states = dict(
+                zip((io.name for io in self.inputs), self._read_inputs())
+            )
+        except Exception as exc:
+            # Never let anybody act on outdated states.
+            with self._cond:
+                self.states = {}
+                self.error = exc
+                self._notify({})
+            raise
+        with self._cond:
+            self.states = states
+            self.error = None
+            self.updated = self.clock.monotonic()
+            self._notify(states)
+        return states
+
+    def _notify(self, states):
+        for listener in self.listeners:
+            listener(states)
+        self._cond.notify_all()
+
+    def age(self):
+        """Seconds since the last successful poll."""
+        if self.updated is None:
+            return float('inf')
+        return self.clock.monotonic() - self.updated
+
+    def _run(self):
+        while self.running:
+            try:
+                self.poll()
+            except Exception as exc:
+                logger.error('Polling of the inputs failed: %s', exc)
+            self.clock.sleep(self.poll_seconds)
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(name='input watcher', target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._thread = None
+
+    def read(self):
+        """Return the latest states, polling when they are not fresh."""
+        with self._cond:
+            if (
+                self.running
+                and self.states
+                and self.age() < 2 * self.poll_seconds
+            ):
+                return self.states
+        return self.poll()
+
+    def _poll_or_raise(self):
+        try:
+            return self.poll()
+        except Exception as exc:
+            raise InputsUnknown("Couldn't read the inputs: {}".format(exc))
+
+    def wait_for(self, predicate, timeout):
+        """Wait until ``predicate(states)`` holds.
+
+        Returns False when it did not happen within ``timeout`` seconds.
+        Raises :class:`InputsUnknown` when a poll fails meanwhile, or when
+        there are no states to judge by at the end.
+        """
+        deadline = self.clock.monotonic() + timeout
+
+        def remaining():
+            return deadline - self.clock.monotonic()
+
+        if not self.running:
+            while not predicate(self._poll_or_raise()):
+                if remaining() <= 0:
+                    return False
+                self.clock.sleep(min(self.poll_seconds, remaining()))
+            return True
+
+        with self._cond:
+            while not (self.states and predicate(self.states)):
+                if self.error is not None:
+                    raise InputsUnknown(
+                        "Couldn't read the inputs: {}".format(self.error)
+                    )
+                if remaining() <= 0:
+                    if not self.states:
+                        raise InputsUnknown(
+                            'The inputs have not been read for {}s.'.format(
+                                timeout
+                            )
+                        )
+                    return False
+                self._cond.wait(remaining())
+            return True
+
+
 def remove_al_prefix_if_exists(s):
     return re.match(r'^(al_)?(.*)', s).group(2)
 
 
 class LostSensor(PivovarError):
     pass
+
+
+class InputsUnknown(PivovarError):
+    """The inputs could not be read, unlike inputs read as not OK."""
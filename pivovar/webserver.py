@@ -1,28 +1,105 @@
 from pivovar import configure_app
+import logging
+import threading
+import time
 import requests
 from flask import Flask, render_template, request
 from urllib.parse import urljoin
 
 
+logger = logging.getLogger('webserver')
+
+
 class DefaultConfig(object):
     PORT = 5000
     WASH_URL = 'http://localhost:5001/'
     INSTANCE_CONFIG_FILE = 'webserver.cfg'
+    # Seconds the wash machine document is served without asking the wash
+    # service again.
+    WASH_MACHINE_TTL = 2.0
+    # Seconds to wait for the wash service, connect and read.
+    WASH_TIMEOUT = 1.0
+
+
+class CachedDocument(object):
+    """JSON document fetched from ``url``, kept for ``ttl`` seconds.
+
+    A stale document is served right away and refreshed in the background,
+    so a slow upstream does not delay the page. Only the first fetch, with
+    nothing cached yet, waits for the upstream, up to ``timeout``. The
+    refreshes are conditional on the ETag, so an unchanged document is not
+    sent again.
+    """
+
+    def __init__(self, url, ttl, timeout, session=None):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.document = None
+        self.etag = None
+        self.fetched = None
+
+    def _fetch(self):
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        try:
+            resp = self.session.get(
+                self.url, headers=headers, timeout=self.timeout
+            )
+            if resp.status_code != 304:
+                resp.raise_for_status()
+                self.document = resp.json()
+                self.etag = resp.headers.get('ETag')
+            self.fetched = time.monotonic()
+        except (requests.RequestException, ValueError) as exc:
+            logger.warning('Cannot fetch %s: %s', self.url, exc)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+        return True
+
+    def get(self):
+        """Return the document, None when it could not be fetched yet."""
+        if self.fetched is not None:
+            if time.monotonic() - self.fetched > self.ttl:
+                if self._start_refresh():
+                    thread = threading.Thread(
+                        name='refresh {}'.format(self.url), target=self._fetch
+                    )
+                    thread.daemon = True
+                    thread.start()
+        elif self._start_refresh():
+            self._fetch()
+        return self.document
 
 
 app = Flask(__name__)
 configure_app(app)
+wash_machine_document = CachedDocument(
+    urljoin(app.config['WASH_URL'], '/wash_machine'),
+    app.config['WASH_MACHINE_TTL'],
+    app.config['WASH_TIMEOUT'],
+)
 
 
 @app.route('/')
 def wash():
     wash_url = app.config['WASH_URL']
 
-    wm = requests.get(urljoin(wash_url, '/wash_machine')).json()
+    wm = wash_machine_document.get() or {}
     return render_template(
         'wash.html',
         temp_log_url=urljoin(wash_url, '/temp_log'),
         wash_machine_url=urljoin(wash_url, '/wash_machine'),
+        events_url=urljoin(wash_url, '/events'),
         wash_machine=wm,
     )
 
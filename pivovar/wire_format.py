@@ -0,0 +1,122 @@
+"""Encodings of the temperature log on the wire and the HTTP compression.
+
+``/temp_log`` can send the sample times as
+
+* ``datetime``: formatted strings, the default,
+* ``epoch``: integer epoch seconds,
+* ``delta``: the first time in epoch seconds and the integer differences
+  of the following ones, mostly the same small number,
+* ``binary``: the columns as little-endian float64 times followed by
+  float32 temperatures (NaN for missing), readable by the browser as
+  ``Float64Array`` and ``Float32Array`` without any parsing.
+"""
+from array import array
+from datetime import datetime
+import math
+import sys
+import zlib
+
+from pivovar.temp_log import TEMP_DIGITS
+
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+FORMATS = ('datetime', 'epoch', 'delta', 'binary')
+BINARY_MIMETYPE = 'application/octet-stream'
+COMPRESSED_MIMETYPES = (
+    'application/json',
+    BINARY_MIMETYPE,
+    'text/html',
+    'text/plain',
+    'text/css',
+    'application/javascript',
+)
+# Smaller bodies do not pay off the compression headers and CPU.
+COMPRESS_MIN_SIZE = 500
+
+
+def encode_times(times, fmt):
+    """Return the JSON fields of the sample ``times`` in ``fmt``."""
+    if fmt == 'epoch':
+        return {'time': [int(round(t)) for t in times]}
+    if fmt == 'delta':
+        epochs = [int(round(t)) for t in times]
+        return {
+            'start': epochs[0] if epochs else None,
+            'deltas': [b - a for a, b in zip(epochs, epochs[1:])],
+        }
+    return {
+        'datetime': [
+            datetime.fromtimestamp(t).strftime(DATETIME_FORMAT) for t in times
+        ]
+    }
+
+
+def encode_temps(temps):
+    return [None if math.isnan(t) else round(t, TEMP_DIGITS) for t in temps]
+
+
+def encode_columns(times, temps):
+    """Return the ``binary`` body: float64 times then float32 temps."""
+    times = array('d', times)
+    temps = array('f', temps)
+    if sys.byteorder == 'big':
+        times.byteswap()
+        temps.byteswap()
+    return times.tobytes() + temps.tobytes()
+
+
+def _accepted_encodings(header):
+    encodings = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header):
+    """Return 'gzip', 'deflate' or None for the Accept-Encoding header."""
+    encodings = _accepted_encodings(header or '')
+    for encoding in ('gzip', 'deflate'):
+        if encodings.get(encoding, encodings.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(response, accept_encoding):
+    """Compress the body of the Flask ``response`` if the client accepts it.
+
+    Streamed responses (the Server-Sent Events) are left alone, they would
+    have to be flushed after every event anyway.
+    """
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code != 200
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSED_MIMETYPES
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encoding)
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(6)
+    response.set_data(compressor.compress(data) + compressor.flush())
+    response.headers['Content-Encoding'] = encoding
+    # The compressed body is another representation of the resource.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
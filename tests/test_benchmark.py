@@ -0,0 +1,42 @@
+from pivovar import benchmark
+from pivovar.fake_evok import FakeEvok
+
+
+def test_run(tmpdir):
+    wm = benchmark.benchmark_machine()
+    results = benchmark.run(wm, FakeEvok.for_wash_machine(wm))
+    assert [r['phase'] for r in results] == [
+        phase.phase_name for phase in wm.wash_cycle
+    ]
+    for result in results:
+        assert result['requests'] > 0
+        assert result['calls'] >= result['requests']
+        assert result['bytes_sent'] > 0
+        assert result['wall'] >= result['sleep']
+
+    table = benchmark.format_table(results)
+    assert 'total' in table.splitlines()[-1]
+
+    path = str(tmpdir.join('results.jsonl'))
+    benchmark.store(path, {'label': 'a', 'results': results})
+    assert benchmark.load_last(path)['label'] == 'a'
+    assert benchmark.load_last(str(tmpdir.join('missing.jsonl'))) is None
+
+
+def test_format_comparison():
+    result = {
+        'phase': 'drying',
+        'requests': 8,
+        'calls': 16,
+        'bytes_sent': 100,
+        'cpu': 0.01,
+        'overshoot': 0.1,
+    }
+    assert benchmark.format_comparison([result], [result]) == (
+        'No change against the baseline.'
+    )
+    comparison = benchmark.format_comparison(
+        [dict(result, requests=4)], [result]
+    )
+    assert 'drying: requests 8 -> 4' in comparison
+    assert 'total: requests 8 -> 4' in comparison
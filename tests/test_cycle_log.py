@@ -0,0 +1,73 @@
+import pytest
+
+from pivovar.cycle_log import CycleLog, PhaseRecord, percentile
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2], 95) == pytest.approx(1.95)
+
+
+def run_cycle(log, start, durations, error_phase=None):
+    log.start_cycle(start)
+    t = start
+    for phase, duration in durations:
+        if phase == error_phase:
+            log.record_phase(PhaseRecord(phase, t, 0.5, error='Boom'))
+        log.record_phase(PhaseRecord(phase, t, duration))
+        t += duration
+    return log.finish_cycle(t)
+
+
+def test_stats():
+    log = CycleLog(limit=2)
+    run_cycle(log, 0, [('heating', 10), ('drying', 20)])
+    cycle = run_cycle(
+        log, 1800, [('heating', 30), ('drying', 20)], error_phase='heating'
+    )
+    assert [record.attempt for record in cycle.phases] == [1, 2, 1]
+    run_cycle(log, 3600, [('heating', 20), ('drying', 20)])
+
+    stats = log.stats()
+    assert stats['cycles'] == 2
+    assert stats['phases']['heating'] == {
+        'count': 2,
+        'errors': 1,
+        'p50': 25.0,
+        'p95': pytest.approx(29.5),
+    }
+    assert stats['cycle_p50'] == 45.0
+    assert stats['kegs_per_hour'] == pytest.approx(2 * 3600.0 / 1840)
+    assert [cycle['cycle'] for cycle in log.recent(1)] == [3]
+
+
+def test_repeated_failures_merged():
+    log = CycleLog()
+    log.start_cycle(0)
+    for i in range(10000):
+        log.record_phase(
+            PhaseRecord('heating', i, 0.5, error='Error {}'.format(i))
+        )
+    log.record_phase(PhaseRecord('heating', 10000, 10))
+    cycle = log.finish_cycle(10010)
+    assert len(cycle.phases) == 2
+    failed, done = cycle.phases
+    assert (failed.attempt, failed.attempts) == (1, 10000)
+    assert failed.duration == 5000
+    assert failed.error == 'Error 9999'
+    assert done.attempt == 10001
+    assert log.stats()['phases']['heating']['errors'] == 10000
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / 'cycles.jsonl')
+    log = CycleLog(path=path)
+    run_cycle(log, 0, [('heating', 10)])
+    run_cycle(log, 100, [('heating', 12)], error_phase='heating')
+
+    restored = CycleLog(path=path)
+    assert restored.recent() == log.recent()
+    restored.start_cycle(200)
+    assert restored.current.cycle == 3
@@ -0,0 +1,45 @@
+import math
+
+from pivovar.downsample import downsample, min_max
+
+
+def test_min_max():
+    times = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+    temps = [5.0, 1.0, 9.0, 3.0, 4.0, 4.0, 2.0, 8.0]
+    assert min_max(times, temps, 4) == (
+        [1.0, 2.0, 6.0, 7.0],
+        [1.0, 9.0, 2.0, 8.0],
+    )
+
+
+def test_min_max_gaps():
+    nan = float('nan')
+    times = [0.0, 1.0, 2.0, 3.0, 100.0, 101.0]
+    temps = [1.0, 1.0, nan, nan, 7.0, nan]
+    out_times, out_temps = min_max(times, temps, 2)
+    assert out_times == [0.0, 2.0, 100.0]
+    assert out_temps[0] == 1.0
+    assert math.isnan(out_temps[1])
+    assert out_temps[2] == 7.0
+
+
+def test_min_max_leading_gap():
+    nan = float('nan')
+    times = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    temps = [nan, 3.0, 1.0, 5.0, 2.0, nan]
+    assert min_max(times, temps, 4) == ([2.0, 3.0, 4.0], [1.0, 5.0, 2.0])
+
+
+def test_downsample_max_points():
+    times = [float(i) for i in range(1000)]
+    temps = [math.sin(t / 50) for t in times]
+    out_times, out_temps = downsample(times, temps, max_points=100)
+    assert len(out_times) <= 100
+    assert max(out_temps) == max(temps)
+    assert min(out_temps) == min(temps)
+    assert out_times == sorted(out_times)
+
+    assert downsample(times[:10], temps[:10], max_points=100) == (
+        times[:10],
+        temps[:10],
+    )
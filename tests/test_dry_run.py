@@ -0,0 +1,26 @@
+import time
+
+import pytest
+
+from pivovar.clock import VirtualClock
+from pivovar.dry_run import dry_run, format_timeline
+from pivovar.wash_machine import WashMachine
+
+
+def test_dry_run_virtual_clock():
+    clock = VirtualClock()
+    wm = WashMachine('dry', required_water_temp=80.0, clock=clock)
+    wm.init_io()
+    wm.io.water_temp.address = 'dry'
+
+    started = time.monotonic()
+    timeline = dry_run(wm)
+    assert time.monotonic() - started < 5
+
+    phases = [phase for _, _, phase in timeline if phase != 'reset']
+    assert phases == [phase.phase_name for phase in wm.wash_cycle]
+    assert sum(duration for _, duration, _ in timeline) == pytest.approx(
+        clock.monotonic()
+    )
+    assert 'filling with CO2' in format_timeline(timeline)
+    assert wm.cycle_log.stats()['cycles'] == 1
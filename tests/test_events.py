@@ -0,0 +1,50 @@
+import json
+
+from pivovar.events import EventBroker, format_sse
+
+
+def test_format_sse():
+    assert format_sse('phase', {'current_phase': 'idle'}) == (
+        'event: phase\ndata: {"current_phase": "idle"}\n\n'
+    )
+
+
+def test_publish():
+    broker = EventBroker()
+    q = broker.subscribe()
+    broker.publish('temp', {'temp': 80.0})
+    assert q.get_nowait() == ('temp', {'temp': 80.0})
+    broker.unsubscribe(q)
+    broker.publish('temp', {'temp': 81.0})
+    assert q.empty()
+
+
+def test_publish_slow_subscriber():
+    broker = EventBroker(queue_size=1)
+    q = broker.subscribe()
+    broker.publish('phase', 1)
+    broker.publish('phase', 2)
+    assert q.get_nowait() == ('phase', 1)
+    assert q.empty()
+
+
+def test_stream():
+    broker = EventBroker()
+    stream = broker.stream(keepalive_seconds=0.01)
+    assert next(stream) == ': keepalive\n\n'
+    broker.publish('phase', {'current_phase': 'drying'})
+    event = next(stream)
+    assert json.loads(event.split('data: ')[1]) == {'current_phase': 'drying'}
+    stream.close()
+    assert not broker._subscribers
+
+
+def test_version():
+    broker = EventBroker()
+    count, created = broker.version('temp')
+    assert count == 0
+    broker.publish('temp', {'temp': 80.0})
+    count, modified = broker.version('temp')
+    assert count == 1
+    assert modified >= created
+    assert broker.version('phase') == (0, created)
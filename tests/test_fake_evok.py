@@ -0,0 +1,80 @@
+import pytest
+
+from pivovar import jsonrpc
+from pivovar.fake_evok import FakeEvok, FakeEvokServer
+from pivovar.wash_machine import WashMachine
+
+
+@pytest.fixture
+def wm():
+    wm = WashMachine('test wash machine')
+    wm.init_io()
+    wm.io.water_temp.address = '28FAKE'
+    wm.tick_secs = 0.001
+    for mv in wm.io.mv.leafs:
+        mv.transition_time = 0.001
+    yield wm
+
+
+@pytest.fixture
+def server(wm):
+    with FakeEvokServer(FakeEvok.for_wash_machine(wm)) as server:
+        wm.unipi_jsonrpc_url = server.url
+        yield server
+
+
+def test_calls(server):
+    client = jsonrpc.Client(server.url)
+    client.relay_set('al_air', True)
+    assert client.relay_get('al_air') == [1, False]
+    assert client.input_get_value('al_fuse_ok') == 1
+    assert client.sensor_get('28FAKE')[:2] == [80.0, False]
+    with pytest.raises(jsonrpc.ProtocolError):
+        client.relay_get('al_unknown')
+    with pytest.raises(jsonrpc.ProtocolError):
+        client._jsonrpc_args_method('unknown_method')
+    assert server.fake.calls['relay_get'] == 2
+
+
+def test_error_rate():
+    fake = FakeEvok(error_rate=1.0)
+    fake.relays['al_air'] = 0
+    resp = fake.handle({'id': 1, 'method': 'relay_get', 'params': ['al_air']})
+    assert 'Injected' in resp['error']['message']
+
+
+def test_wash_machine_end_to_end(wm, server):
+    wm.check()
+    wm.reset()
+    wm.wait_for_keg()
+    wm.heating()
+    for phase in wm.wash_cycle[3:]:
+        phase()
+        wm.reset()
+        assert not any(server.fake.relays.values())
+    assert server.fake.calls['relay_set'] > 0
+
+
+def test_reset_free_when_all_off(wm, server):
+    wm.reset()
+    calls = dict(server.fake.calls)
+    wm.reset()
+    assert server.fake.calls == calls
+
+
+def test_prepare_valve_positions(wm, server):
+    # (water_or_lye, drain_or_recirculation) each phase starts with.
+    expected = {
+        'washing with lye': (1, 0),
+        'washing with cold water': (0, 1),
+        'washing with hot water': (0, 1),
+    }
+    wm.check()
+    for phase in wm.wash_cycle:
+        wm.prepare(phase)
+        relays = server.fake.relays
+        assert (
+            relays.get('al_water_or_lye', 0),
+            relays.get('al_drain_or_recirculation', 0),
+        ) == expected.get(phase.phase_name, (0, 0)), phase.phase_name
+        phase()
@@ -0,0 +1,200 @@
+import json
+import threading
+
+import pytest
+import requests
+
+from pivovar import jsonrpc
+
+from .themock import MagicMock, patch
+
+
+@pytest.fixture
+def client():
+    client = jsonrpc.Client('http://fake/rpc')
+    client.session = MagicMock()
+    yield client
+
+
+def posted(client):
+    return json.loads(client.session.post.call_args[1]['data'])
+
+
+def test_call(client):
+    client.session.post.return_value.json.return_value = {
+        'id': 1,
+        'jsonrpc': '2.0',
+        'result': [1, 0],
+    }
+    assert client.relay_get('al_air') == [1, 0]
+    assert posted(client)['method'] == 'relay_get'
+
+
+def test_call_error(client):
+    client.session.post.return_value.json.return_value = {
+        'id': 1,
+        'jsonrpc': '2.0',
+        'error': {'message': 'no such alias', 'code': -32000},
+    }
+    with pytest.raises(jsonrpc.ProtocolError):
+        client.relay_get('al_air')
+
+
+def test_batch(client):
+    client.session.post.return_value.json.return_value = [
+        {
+            'id': 2,
+            'jsonrpc': '2.0',
+            'error': {'message': 'no such alias', 'code': -32000},
+        },
+        {'id': 1, 'jsonrpc': '2.0', 'result': [1, 0]},
+    ]
+    with client.batch() as batch:
+        air = batch.relay_get('al_air')
+        fuse = batch.input_get_value('al_fuse_ok')
+        assert not air.done
+
+    assert client.session.post.call_count == 1
+    assert [r['method'] for r in posted(client)] == [
+        'relay_get',
+        'input_get_value',
+    ]
+    assert air.result() == [1, 0]
+    with pytest.raises(jsonrpc.ProtocolError):
+        fuse.result()
+
+
+def test_empty_batch(client):
+    with client.batch():
+        pass
+    assert not client.session.post.called
+
+
+def ok(result):
+    resp = MagicMock()
+    resp.json.return_value = {'id': 1, 'jsonrpc': '2.0', 'result': result}
+    return resp
+
+
+@patch('time.sleep')
+def test_read_retried(sleep_mock, client):
+    client.session.post.side_effect = [
+        requests.ConnectionError(),
+        requests.Timeout(),
+        ok([1, 0]),
+    ]
+    assert client.relay_get('al_air') == [1, 0]
+    assert client.session.post.call_args[1]['timeout'] == client.timeout
+    assert sleep_mock.call_count == 2
+    health = client.health()
+    assert health['retried'] == 2
+    assert health['timeouts'] == 1
+    assert health['state'] == 'closed'
+    assert health['consecutive_failures'] == 0
+
+
+@patch('time.sleep')
+def test_write_not_retried(sleep_mock, client):
+    client.session.post.side_effect = [requests.Timeout(), ok(1)]
+    with pytest.raises(requests.Timeout):
+        client.relay_set('al_air', 1)
+    assert client.session.post.call_count == 1
+
+
+@patch('time.sleep')
+@patch('pivovar.jsonrpc.time.monotonic')
+def test_circuit_breaker(monotonic_mock, sleep_mock):
+    monotonic_mock.return_value = 0.0
+    client = jsonrpc.Client(
+        'http://fake/rpc', retries=0, failure_threshold=2, reset_seconds=5
+    )
+    client.session = MagicMock()
+    client.session.post.side_effect = requests.ConnectionError()
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            client.input_get_value('al_fuse_ok')
+    with pytest.raises(jsonrpc.CircuitOpenError):
+        client.input_get_value('al_fuse_ok')
+    assert client.session.post.call_count == 2
+    assert client.health()['state'] == 'open'
+    assert client.health()['rejected'] == 1
+
+    monotonic_mock.return_value = 6.0
+    client.session.post.side_effect = None
+    client.session.post.return_value = ok(1)
+    assert client.input_get_value('al_fuse_ok') == 1
+    assert client.health()['state'] == 'closed'
+
+
+def test_retry_budget():
+    budget = jsonrpc.RetryBudget(ratio=0.5, max_tokens=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_max_call_seconds():
+    client = jsonrpc.Client(
+        'http://fake/rpc', timeout=(1, 2), retries=1, backoff=0.1
+    )
+    assert client.max_call_seconds == pytest.approx(3 * 2 + 0.15)
+
+
+def test_unique_ids(client):
+    ids = []
+
+    def take():
+        ids.extend(client._next_id() for _ in range(1000))
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(ids) == list(range(1, 4001))
+
+
+def test_reads_coalesced(client):
+    entered = threading.Event()
+    release = threading.Event()
+
+    def post(url, data, timeout):
+        entered.set()
+        release.wait(1)
+        resp = MagicMock()
+        resp.json.return_value = {
+            'id': json.loads(data)['id'],
+            'jsonrpc': '2.0',
+            'result': [1, 0],
+        }
+        return resp
+
+    client.session.post.side_effect = post
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(client.relay_get('al_air'))
+        )
+        for _ in range(2)
+    ]
+    threads[0].start()
+    entered.wait(1)
+    threads[1].start()
+    while not client.coalesced:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [[1, 0], [1, 0]]
+    assert client.session.post.call_count == 1
+    assert not client._inflight
+
+
+def test_writes_not_coalesced(client):
+    client.session.post.return_value = ok(True)
+    client.relay_set('al_air', True)
+    client.relay_set('al_air', True)
+    assert client.session.post.call_count == 2
+    assert client.coalesced == 0
@@ -0,0 +1,91 @@
+import pytest
+
+from pivovar import jsonrpc, metrics
+
+from .themock import MagicMock
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram(
+        'test_seconds', 'Test histogram.', ('method',), buckets=(0.1, 1)
+    )
+    histogram.labels('relay_get').observe(0.05)
+    histogram.labels('relay_get').observe(0.5)
+    histogram.labels('relay_get').observe(5)
+    assert histogram.render().split('\n') == [
+        '# HELP test_seconds Test histogram.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{method="relay_get",le="0.1"} 1',
+        'test_seconds_bucket{method="relay_get",le="1.0"} 2',
+        'test_seconds_bucket{method="relay_get",le="+Inf"} 3',
+        'test_seconds_sum{method="relay_get"} 5.55',
+        'test_seconds_count{method="relay_get"} 3',
+    ]
+
+
+def test_counter_render():
+    counter = metrics.Counter('test_total', 'Test "counter".', ('name',))
+    counter.labels('a"b').inc(2)
+    assert counter.render().split('\n') == [
+        '# HELP test Test "counter".',
+        '# TYPE test counter',
+        'test_total{name="a\\"b"} 2',
+    ]
+    with pytest.raises(ValueError):
+        counter.labels()
+
+
+def test_metric_needs_values():
+    class Gauge(metrics.Metric):
+        type = 'gauge'
+
+    with pytest.raises(TypeError):
+        Gauge('test', 'Metric without values.')
+
+
+def test_client_metrics():
+    client = jsonrpc.Client('http://fake/rpc')
+    client._post = MagicMock()
+    calls = metrics.RPC_CALLS.labels('owbus_scan')
+    errors = metrics.RPC_ERRORS.labels('owbus_scan')
+    latency = metrics.RPC_LATENCY.labels('owbus_scan')
+    before = calls.value, errors.value, latency.count
+
+    client._post.return_value = {'result': []}
+    client.owbus_scan('1')
+    client._post.return_value = {'error': {'message': 'busy', 'code': -1}}
+    with pytest.raises(jsonrpc.ProtocolError):
+        client.owbus_scan('1')
+    client._post.side_effect = ConnectionError()
+    with pytest.raises(ConnectionError):
+        client.owbus_scan('1')
+
+    assert calls.value - before[0] == 3
+    assert errors.value - before[1] == 2
+    assert latency.count - before[2] == 3
+
+
+def test_batch_metrics():
+    client = jsonrpc.Client('http://fake/rpc')
+    client._post = MagicMock()
+    calls = metrics.RPC_CALLS.labels('owbus_list')
+    errors = metrics.RPC_ERRORS.labels('owbus_list')
+    before = calls.value, errors.value
+
+    def respond(requests):
+        first, second = requests
+        return [
+            {'id': first['id'], 'result': []},
+            {'id': second['id'], 'error': {'message': 'busy', 'code': -1}},
+        ]
+
+    client._post.side_effect = respond
+    with client.batch() as batch:
+        batch.owbus_list('1')
+        batch.owbus_list('2')
+
+    assert calls.value - before[0] == 2
+    assert errors.value - before[1] == 1
+    assert 'pivovar_rpc_latency_seconds_count{method="batch"}' in (
+        metrics.render()
+    )
@@ -0,0 +1,49 @@
+from pivovar.scheduler import Schedule
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_latency_does_not_accumulate():
+    clock = FakeClock()
+    schedule = Schedule(smoothing=0, clock=clock)
+    for i in range(5):
+        clock.now += 0.05  # RPC latency
+        schedule.wait(1)
+    assert clock.now == 105.0
+    assert [step.planned for step in schedule.steps] == [1, 2, 3, 4, 5]
+    assert all(step.lag == 0 for step in schedule.steps)
+
+
+def test_step_latency_compensation():
+    clock = FakeClock()
+
+    def action():
+        clock.now += 0.1
+
+    schedule = Schedule(smoothing=1, clock=clock)
+    schedule.step('on', action)
+    schedule.wait(1)
+    assert round(clock.now, 6) == 100.9
+    schedule.step('off', action)
+    assert round(clock.now, 6) == 101.0
+    report = schedule.report()
+    assert [step['name'] for step in report] == ['on', 'wait', 'off']
+    assert round(report[2]['duration'], 6) == 0.1
+
+
+def test_large_lag_shifts_schedule():
+    clock = FakeClock()
+    schedule = Schedule(max_lag=0.5, clock=clock)
+    clock.now += 5  # valve switching
+    schedule.wait(1)
+    assert clock.now == 106.0
+    assert schedule.steps[0].planned == 6.0
@@ -0,0 +1,73 @@
+import configparser
+
+from pivovar.supervisor import Supervisor
+from pivovar.wash_machine_async import AsyncWashMachine
+
+from .themock import patch
+
+CONFIG = '''
+[DEFAULT]
+required_water_temp = 80
+heating_sleep_seconds = 3
+real_temp_update_seconds = 15
+tick_secs = 1
+
+[wash_machine_1]
+unipi_jsonrpc_url = http://neuron/rpc
+
+[wash_machine_2]
+unipi_jsonrpc_url = http://neuron/rpc
+
+[wash_machine_3]
+unipi_jsonrpc_url = http://other-neuron/rpc
+
+[something_else]
+'''
+
+
+def config():
+    config = configparser.ConfigParser()
+    config.read_string(CONFIG)
+    return config
+
+
+def test_from_config():
+    supervisor = Supervisor.from_config(config=config())
+    assert list(supervisor.machines) == [
+        'wash_machine_1',
+        'wash_machine_2',
+        'wash_machine_3',
+    ]
+    wm1, wm2, wm3 = supervisor.machines.values()
+    assert wm1.unipi_jsonrpc is wm2.unipi_jsonrpc
+    assert wm1.unipi_jsonrpc is not wm3.unipi_jsonrpc
+    assert wm3.unipi_jsonrpc.url == 'http://other-neuron/rpc'
+
+
+def test_from_config_async():
+    supervisor = Supervisor.from_config(AsyncWashMachine, config())
+    wm1, wm2, wm3 = supervisor.machines.values()
+    assert wm1.unipi_jsonrpc_async is wm2.unipi_jsonrpc_async
+    assert wm1.unipi_jsonrpc_async is not wm3.unipi_jsonrpc_async
+
+
+@patch('pivovar.wash_machine_io.InputWatcher.start')
+@patch('pivovar.supervisor.Thread')
+def test_start(thread_mock, watcher_start_mock):
+    supervisor = Supervisor.from_config(config=config())
+    supervisor.start()
+    assert thread_mock.return_value.start.call_count == 6
+    assert watcher_start_mock.call_count == 3
+
+
+@patch('pivovar.wash_machine_io.InputWatcher._run')
+@patch('pivovar.supervisor.Thread')
+def test_start_async(thread_mock, run_mock):
+    supervisor = Supervisor.from_config(AsyncWashMachine, config())
+    supervisor.start()
+    assert thread_mock.return_value.start.call_count == 1
+    for coro in thread_mock.call_args[1]['args']:
+        coro.close()
+    for wm in supervisor.machines.values():
+        assert wm.input_watcher.running
+        wm.input_watcher.stop()
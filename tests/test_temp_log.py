@@ -0,0 +1,61 @@
+import math
+from datetime import datetime
+
+from pivovar.temp_log import TempLog
+
+
+def test_append():
+    log = TempLog(3)
+    log.append(1.0, 10.5)
+    log.append(2.0, None)
+    assert len(log) == 2
+    assert list(log.times()) == [1.0, 2.0]
+    assert log.temps_list() == [10.5, None]
+    assert math.isnan(log.temps()[1])
+
+
+def test_wrap_around():
+    log = TempLog(3)
+    for i in range(5):
+        log.append(float(i), float(i))
+    assert len(log) == 3
+    assert log.first == 2
+    assert list(log.times()) == [2.0, 3.0, 4.0]
+    assert log.temps_list() == [2.0, 3.0, 4.0]
+
+
+def test_cursor():
+    log = TempLog(3)
+    for i in range(5):
+        log.append(float(i), float(i))
+    assert list(log.times(4)) == [4.0]
+    assert list(log.times(0)) == [2.0, 3.0, 4.0]
+    assert list(log.times(5)) == []
+
+
+def test_iter():
+    log = TempLog(2)
+    date = datetime(2018, 8, 24, 15, 3, 54)
+    log.append(date.timestamp(), 80.2)
+    assert list(log) == [(date, 80.2)]
+
+
+def test_columns():
+    log = TempLog(3)
+    for i in range(5):
+        log.append(float(i), float(i))
+    [(times, temps)] = log.columns(2, 4)
+    assert list(times) == [2.0, 3.0]
+    assert list(temps) == [2.0, 3.0]
+    assert log.cursor_at(3.5) == 4
+
+
+def test_snapshot():
+    log = TempLog(3)
+    for i in range(3):
+        log.append(float(i), float(i))
+    snapshot = log.snapshot()
+    log.append(3.0, 3.0)
+    assert snapshot.appended == 3
+    assert list(snapshot.times()) == [0.0, 1.0, 2.0]
+    assert list(log.times()) == [1.0, 2.0, 3.0]
@@ -0,0 +1,75 @@
+import math
+import os
+
+from pivovar.temp_store import TempStore
+
+
+def test_append(tmp_path):
+    store = TempStore(str(tmp_path), capacity=10)
+    store.append(1.0, 10.5)
+    store.append(2.0, None)
+    assert len(store) == 2
+    assert store.times() == [1.0, 2.0]
+    assert store.temps_list() == [10.5, None]
+    assert math.isnan(store.temps()[1])
+    assert store.times(1) == [2.0]
+    assert store.times(2) == []
+
+
+def test_cursor_at(tmp_path):
+    store = TempStore(str(tmp_path), capacity=10, segment_seconds=10)
+    for i in range(30):
+        store.append(float(i * 2), float(i))
+    assert store.cursor_at(-1) == 0
+    assert store.cursor_at(11) == 6
+    assert store.cursor_at(20) == 10
+    assert store.cursor_at(100) == 30
+    columns = list(store.columns(4, 12))
+    assert len(columns) == 3
+    assert [t for times, _ in columns for t in times] == [
+        float(i * 2) for i in range(4, 12)
+    ]
+
+
+def test_rollover_and_retention(tmp_path):
+    store = TempStore(
+        str(tmp_path), capacity=10, retention_seconds=25, segment_seconds=10
+    )
+    for i in range(50):
+        store.append(float(i), float(i))
+    # Expired when a new segment is started, at 40.
+    assert len(os.listdir(str(tmp_path))) == 4
+    assert store.first == 10
+    assert store.times()[0] == 10.0
+    assert store.appended == 50
+
+
+def test_reopen(tmp_path):
+    store = TempStore(str(tmp_path), capacity=10, segment_seconds=10)
+    for i in range(15):
+        store.append(float(i), float(i))
+    store.close()
+    # Torn write of a crash.
+    with open(store._segments[-1].path, 'ab') as f:
+        f.write(b'\0' * 3)
+
+    store = TempStore(str(tmp_path), capacity=10, segment_seconds=10)
+    assert store.appended == 15
+    store.append(15.0, 15.0)
+    assert store.temps_list(14) == [14.0, 15.0]
+
+
+def test_snapshot(tmp_path):
+    store = TempStore(
+        str(tmp_path), capacity=10, retention_seconds=5, segment_seconds=10
+    )
+    for i in range(15):
+        store.append(float(i), float(i))
+    snapshot = store.snapshot()
+    # Starts a segment and removes the first one.
+    for i in range(15, 25):
+        store.append(float(i), float(i))
+    assert store.first == 10
+    assert snapshot.first == 0
+    assert snapshot.appended == 15
+    assert snapshot.times() == [float(i) for i in range(15)]
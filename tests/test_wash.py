@@ -1,9 +1,13 @@
 import pytest
 import json
+from array import array
+import gzip
 from datetime import datetime, timedelta
 
 from pivovar import wash
 from pivovar import wash_machine
+from pivovar import wash_machine_io as wm_io
+from pivovar.temp_store import TempStore
 
 from .themock import MagicMock, patch
 
@@ -21,7 +25,10 @@ def mocked_backend_wm(rpc_client_mock):
     wm.init_io()
     wm.io.inp.fuse_ok.read_state = MagicMock(return_value=True)
     wm.io.inp.total_stop.read_state = MagicMock(return_value=False)
-    wm.io.inp.keg_present.read_state = MagicMock(side_effect=[False, True])
+    wm.io.inp.keg_present.read_state = MagicMock(return_value=True)
+    wm.input_watcher._read_inputs = lambda: [
+        inp.read_state() for inp in wm.input_watcher.inputs
+    ]
     yield wm
 
 
@@ -73,6 +80,7 @@ def test_wait_for_keg(sleep_mock, mocked_backend_wm):
         side_effect=[False, True]
     )
     mocked_backend_wm.wait_for_keg()
+    assert sleep_mock.call_count == 1
 
 
 @patch("time.sleep")
@@ -132,16 +140,90 @@ def test_temps_update(
     assert logger_mock.exception.called
 
 
-@patch(
-    "pivovar.wash_machine.WashMachine.is_fuse_blown", side_effect=[True, False]
-)
-@patch(
-    "pivovar.wash_machine.WashMachine.is_total_stop_pressed",
-    side_effect=[True, False],
-)
-@patch("pivovar.wash_machine.time")
-def test_wait_until_inputs_ok(time_mock, fb, ts, mocked_backend_wm):
-    mocked_backend_wm.wait_until_inputs_ok()
+@patch("time.sleep")
+@patch("logging.info")
+def test_wait_until_inputs_ok(info_mock, sleep_mock, mocked_backend_wm):
+    wm = mocked_backend_wm
+    wm.io.inp.fuse_ok.read_state = MagicMock(side_effect=[False, True, True])
+    wm.io.inp.total_stop.read_state = MagicMock(
+        side_effect=[True, True, False]
+    )
+    wm.wait_until_inputs_ok()
+    assert info_mock.call_count == 3
+    assert sleep_mock.call_count == 1
+    assert wm.safety.is_ok()
+
+
+@patch("time.sleep")
+def test_delay_uses_safety_state(sleep_mock, mocked_backend_wm):
+    wm = mocked_backend_wm
+    wm.input_watcher.poll()
+    wm.input_watcher.poll_seconds = 60
+    wm.io.inp.fuse_ok.read_state.reset_mock()
+    wm.delay(1)
+    assert not wm.io.inp.fuse_ok.read_state.called
+
+    wm.safety.problems = {'TOTAL_STOP is pressed.'}
+    wm.input_watcher.updated -= 1000
+    wm.delay(1)
+    assert wm.io.inp.fuse_ok.read_state.called
+    assert wm.safety.is_ok()
+
+
+def test_input_watcher_wait_for_timeout(mocked_backend_wm):
+    watcher = mocked_backend_wm.input_watcher
+    watcher.poll_seconds = 0.001
+    assert not watcher.wait_for(lambda s: not s['keg_present'], timeout=0.01)
+    assert watcher.wait_for(lambda s: s['keg_present'], timeout=0.01)
+
+
+def test_input_watcher_inputs_unknown(mocked_backend_wm):
+    watcher = mocked_backend_wm.input_watcher
+    watcher.poll_seconds = 0.001
+    watcher._read_inputs = MagicMock(side_effect=ConnectionError('dead'))
+    with pytest.raises(wm_io.InputsUnknown):
+        watcher.wait_for(lambda s: s['keg_present'], timeout=0.01)
+
+    watcher.start()
+    try:
+        with pytest.raises(wm_io.InputsUnknown):
+            watcher.wait_for(lambda s: s['keg_present'], timeout=1)
+    finally:
+        watcher.stop()
+
+
+@patch("pivovar.wash_machine.ERROR_SLEEP_TIME", 0)
+def test_phase_fails_on_unreadable_inputs(mocked_backend_wm):
+    wm = mocked_backend_wm
+    wm.tick_secs = 0.001
+    wm.input_watcher.poll_seconds = 0.001
+    wm.input_watcher._read_inputs = MagicMock(
+        side_effect=ConnectionError('dead')
+    )
+    wm.keep_running = MagicMock(side_effect=[True, False])
+    wm.keep_repeating = MagicMock(side_effect=[True, False])
+    wm.wash_cycle = [wm.fill_with_co2]
+    wm.input_watcher.start()
+    try:
+        with pytest.raises(wm_io.InputsUnknown):
+            wm.fill_with_co2()
+        wm.wash_the_kegs()
+    finally:
+        wm.input_watcher.stop()
+    assert wm.io.out.error_lamp.shadow
+    [cycle] = wm.cycle_log.recent()
+    assert 'InputsUnknown' in cycle['phases'][-1]['error']
+
+
+def test_input_watcher_thread(mocked_backend_wm):
+    watcher = mocked_backend_wm.input_watcher
+    watcher.poll_seconds = 0.001
+    watcher.start()
+    try:
+        assert watcher.wait_for(lambda s: s['keg_present'], timeout=1)
+        assert watcher.read()['fuse_ok']
+    finally:
+        watcher.stop()
 
 
 def test_washing_machine_add_temp(mocked_backend_wm):
@@ -185,3 +267,304 @@ def test_real_temps(flask_client):
 
 def test_index(flask_client):
     assert flask_client.get('/')
+
+
+@patch("time.sleep")
+@patch("pivovar.wash_machine.wm_io.set_states")
+@patch("pivovar.wash_machine.wm_io.read_states")
+def test_reset(read_states, set_states, sleep_mock, mocked_backend_wm):
+    wm = mocked_backend_wm
+    rlys = list(wm.io.rly.all_leafs())
+    read_states.return_value = [False] * len(rlys) + [True, False]
+    wm.reset()
+    assert read_states.call_count == 1
+    switched = set_states.call_args[0][1]
+    assert wm.io.mv.water_or_lye in switched
+    assert wm.io.mv.drain_or_recirculation in switched
+    # The valves move on while the next phase starts.
+    assert not sleep_mock.called
+    assert not wm.io.mv.water_or_lye.movement.done()
+    assert wm.io.mv.drain_or_recirculation.movement.done()
+
+
+@patch("pivovar.wash_machine.wm_io.set_states")
+@patch("pivovar.wash_machine.wm_io.shadow_states")
+def test_prepare(shadow_states, set_states, mocked_backend_wm):
+    wm = mocked_backend_wm
+    outputs = wm.planned_outputs()
+    assert wm.io.rly.water_or_lye not in outputs
+    states = {io.conf_key: False for io in outputs}
+    states['io.rly.drain'] = True
+    states['io.mv.water_or_lye'] = True
+    shadow_states.side_effect = lambda rpc, ios: [
+        states[io.conf_key] for io in ios
+    ]
+
+    wm.prepare(wm.wash_with_hot_water)
+    assert [call[0][1:] for call in set_states.call_args_list] == [
+        ([wm.io.rly.drain, wm.io.mv.water_or_lye], False),
+        ([wm.io.mv.drain_or_recirculation], True),
+    ]
+    assert not wm.io.mv.drain_or_recirculation.movement.done()
+
+    set_states.reset_mock()
+    # The valves not declared by the phase go to their safe position.
+    wm.prepare(wm.fill_with_co2)
+    assert [call[0][1:] for call in set_states.call_args_list] == [
+        ([wm.io.rly.drain, wm.io.mv.water_or_lye], False)
+    ]
+
+
+@patch("time.sleep")
+def test_shadows_forgotten_on_phase_failure(sleep_mock, mocked_backend_wm):
+    wm = mocked_backend_wm
+    outputs = [wm.io.rly.pump, wm.io.out.error_lamp, wm.io.mv.water_or_lye]
+    for io in outputs:
+        io.turn_on()
+        assert io.shadow
+    wm.io.rly.pump.turn_on = MagicMock(side_effect=Exception('failed'))
+    with pytest.raises(Exception):
+        wm.wash_with_lye()
+    assert [io.shadow for io in outputs] == [None, None, None]
+
+
+def test_real_temps_since(flask_client):
+    temp_log = wash.wash_machine.temp_log
+    wash.wash_machine.add_temp(datetime(2018, 8, 24, 15, 3, 54), 10)
+    response = json.loads(flask_client.get('/temp_log').data.decode())
+    assert response['full']
+    assert response['cursor'] == temp_log.appended
+    cursor = response['cursor']
+
+    wash.wash_machine.add_temp(datetime(2018, 8, 24, 15, 3, 55), 11)
+    response = json.loads(
+        flask_client.get('/temp_log?since={}'.format(cursor)).data.decode()
+    )
+    assert not response['full']
+    assert response['datetime'] == ["2018-08-24 15:03:55"]
+    assert response['temps'] == [11]
+    assert response['cursor'] == cursor + 1
+
+    response = json.loads(flask_client.get('/temp_log?since=-1').data.decode())
+    assert response['full']
+
+
+def test_phase_events(mocked_backend_wm):
+    wm = mocked_backend_wm
+    q = wm.events.subscribe()
+
+    async def fill_with_co2(self):
+        pass
+
+    wm.fill_with_co2 = wash_machine.phase('filling with CO2')(
+        fill_with_co2
+    ).__get__(wm)
+    wm.fill_with_co2()
+    event, data = q.get_nowait()
+    assert event == 'phase'
+    assert data['current_phase'] == 'filling with CO2'
+    assert q.get_nowait()[1]['current_phase'] == 'idle'
+    date = datetime(2018, 8, 24, 15, 3, 54)
+    wm.add_temp(date, 80)
+    assert q.get_nowait() == (
+        'temp',
+        {
+            'cursor': 1,
+            'time': date.timestamp(),
+            'datetime': '2018-08-24 15:03:54',
+            'temp': 80,
+        },
+    )
+
+
+def test_wash_machines(flask_client):
+    assert json.loads(flask_client.get('/wash_machines').data.decode()) == [
+        'wash_machine_1'
+    ]
+    response = flask_client.get('/wash_machines/wash_machine_1')
+    assert json.loads(response.data.decode())['name'] == 'wash_machine_1'
+    response = flask_client.get('/wash_machines/wash_machine_1/temp_log')
+    assert 'cursor' in json.loads(response.data.decode())
+    assert flask_client.get('/wash_machines/unknown').status_code == 404
+
+
+@patch("time.sleep")
+def test_prewash_schedule(sleep_mock, mocked_backend_wm):
+    wm = mocked_backend_wm
+    wm.prewash()
+    steps = [step['name'] for step in wm.schedules['prewashing'].report()]
+    assert steps.count('cold_water on') == 5
+    assert steps.count('cold_water off') == 5
+    assert len(steps) == 19
+
+
+def test_metrics(flask_client, mocked_backend_wm):
+    wm = mocked_backend_wm
+
+    async def fill_with_co2(self):
+        pass
+
+    wm.fill_with_co2 = wash_machine.phase('filling with CO2')(
+        fill_with_co2
+    ).__get__(wm)
+    wm.fill_with_co2()
+    response = flask_client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    assert (
+        'pivovar_phase_duration_seconds_count{{machine="{}",'
+        'phase="filling with CO2"}}'.format(wm.name)
+    ) in response.data.decode()
+
+
+def test_phase_failure_recorded(mocked_backend_wm):
+    wm = mocked_backend_wm
+
+    async def fail(self):
+        raise RuntimeError('Valve stuck')
+
+    wm.drain = wash_machine.phase('draining')(fail).__get__(wm)
+    wm.cycle_started()
+    with pytest.raises(RuntimeError):
+        wm.drain()
+    wm.cycle_finished()
+    record = wm.cycle_log.recent()[-1]['phases'][-1]
+    assert record['phase'] == 'draining'
+    assert record['error'] == "RuntimeError('Valve stuck')"
+
+
+def test_cycles(flask_client):
+    wm = wash.wash_machine
+    wm.cycle_started()
+    wm.cycle_finished()
+    response = json.loads(flask_client.get('/cycles?limit=1').data.decode())
+    assert len(response['cycles']) == 1
+    assert response['stats']['cycles'] >= 1
+    response = flask_client.get('/wash_machines/wash_machine_1/cycles')
+    assert 'kegs_per_hour' in json.loads(response.data.decode())['stats']
+
+
+def test_real_temps_from_store(flask_client, tmp_path):
+    wm = wash.wash_machine
+    temp_log = wm.temp_log
+    wm.temp_log = TempStore(str(tmp_path), capacity=2)
+    try:
+        for i in range(3):
+            wm.add_temp(datetime(2018, 8, 24, 15, 3, 54 + i), 10 + i)
+        response = json.loads(flask_client.get('/temp_log').data.decode())
+    finally:
+        wm.temp_log = temp_log
+    assert response['cursor'] == 3
+    assert response['temps'] == [11, 12]
+    assert response['datetime'] == [
+        "2018-08-24 15:03:55",
+        "2018-08-24 15:03:56",
+    ]
+
+
+def test_real_temps_downsampled(flask_client, tmp_path):
+    wm = wash.wash_machine
+    temp_log = wm.temp_log
+    wm.temp_log = TempStore(str(tmp_path), capacity=1000)
+    try:
+        start = datetime(2018, 8, 24, 15, 0, 0)
+        for i in range(100):
+            wm.add_temp(start + timedelta(seconds=i), i % 10)
+        response = json.loads(
+            flask_client.get('/temp_log?max_points=20').data.decode()
+        )
+        assert len(response['temps']) == 20
+        assert set(response['temps']) == {0, 9}
+        response = json.loads(
+            flask_client.get(
+                '/temp_log?from=2018-08-24 15:00:10&to={}'.format(
+                    (start + timedelta(seconds=20)).timestamp()
+                )
+            ).data.decode()
+        )
+        assert response['full']
+        assert response['datetime'][0] == '2018-08-24 15:00:10'
+        assert len(response['temps']) == 10
+    finally:
+        wm.temp_log = temp_log
+
+
+def test_conditional_get(flask_client):
+    wm = wash.wash_machine
+    response = flask_client.get('/wash_machine')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+    response = flask_client.get(
+        '/wash_machine', headers={'If-None-Match': etag}
+    )
+    assert response.status_code == 304
+    assert not response.data
+
+    wm.events.publish('phase', {'current_phase': 'idle'})
+    response = flask_client.get(
+        '/wash_machine', headers={'If-None-Match': etag}
+    )
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    response = flask_client.get('/wash_machines/wash_machine_1/temp_log')
+    # Changes within the same second as the Last-Modified are not missed.
+    wm.add_temp(datetime.now(), 80)
+    response = flask_client.get(
+        '/wash_machines/wash_machine_1/temp_log',
+        headers={'If-Modified-Since': response.headers['Last-Modified']},
+    )
+    assert response.status_code == 200
+    response = flask_client.get(
+        '/wash_machines/wash_machine_1/temp_log',
+        headers={'If-None-Match': response.headers['ETag']},
+    )
+    assert response.status_code == 304
+    wm.add_temp(datetime.now(), 80)
+    response = flask_client.get(
+        '/wash_machines/wash_machine_1/temp_log',
+        headers={'If-None-Match': response.headers['ETag']},
+    )
+    assert response.status_code == 200
+
+
+def test_real_temps_formats(flask_client, tmp_path):
+    wm = wash.wash_machine
+    temp_log = wm.temp_log
+    wm.temp_log = TempStore(str(tmp_path), capacity=1000)
+    try:
+        start = datetime(2018, 8, 24, 15, 0, 0)
+        for i in range(100):
+            wm.add_temp(start + timedelta(seconds=15 * i), 80 + i % 3)
+        response = json.loads(
+            flask_client.get('/temp_log?format=delta').data.decode()
+        )
+        assert response['start'] == int(start.timestamp())
+        assert response['deltas'] == [15] * 99
+        assert 'datetime' not in response
+
+        response = flask_client.get(
+            '/temp_log?format=binary', headers={'Accept-Encoding': 'gzip'}
+        )
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['X-Cursor'] == '100'
+        exposed = flask_client.get(
+            '/temp_log?format=binary',
+            headers={'Origin': 'http://dashboard:5000'},
+        ).headers['Access-Control-Expose-Headers']
+        assert {'X-Cursor', 'X-Capacity', 'X-Full', 'ETag'} <= {
+            header.strip() for header in exposed.split(',')
+        }
+        body = gzip.decompress(response.data)
+        assert len(body) == 100 * (8 + 4)
+        assert array('f', body[800:])[:3].tolist() == [80, 81, 82]
+    finally:
+        wm.temp_log = temp_log
+
+
+def test_health(flask_client):
+    response = json.loads(flask_client.get('/health').data.decode())
+    assert response['rpc']['state'] == 'closed'
+    assert 'safety_problems' in response
+    response = flask_client.get('/wash_machines/wash_machine_1/health')
+    assert response.status_code == 200
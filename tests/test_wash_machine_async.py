@@ -0,0 +1,231 @@
+import asyncio
+import json
+
+import pytest
+
+from pivovar import jsonrpc
+from pivovar.clock import VirtualClock
+from pivovar.wash_machine import WashMachine
+from pivovar.wash_machine_async import AsyncWashMachine
+
+from .themock import MagicMock, patch
+
+
+class FakeEvok(object):
+    """Minimal asyncio JSON-RPC server keeping relays and inputs state."""
+
+    def __init__(self):
+        self.relays = {}
+        self.inputs = {'al_fuse_ok': 1, 'al_keg_present': 1}
+        self.requests = 0
+
+    def call(self, request):
+        method, params = request['method'], request['params']
+        if method == 'relay_set':
+            self.relays[params[0]] = int(params[1])
+            result = True
+        elif method == 'relay_get':
+            result = [self.relays.get(params[0], 0), 0]
+        elif method == 'input_get_value':
+            result = self.inputs.get(params[0], 0)
+        elif method == 'sensor_get':
+            result = [80.5, False, 0, 15]
+        else:
+            return {
+                'id': request['id'],
+                'error': {'message': 'Unknown method', 'code': -32601},
+            }
+        return {'id': request['id'], 'jsonrpc': '2.0', 'result': result}
+
+    async def handle(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            length = 0
+            while line not in (b'\r\n', b''):
+                line = await reader.readline()
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            payload = json.loads((await reader.readexactly(length)).decode())
+            self.requests += 1
+            if isinstance(payload, list):
+                resp = [self.call(request) for request in payload]
+            else:
+                resp = self.call(payload)
+            body = json.dumps(resp).encode()
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Length: '
+                + str(len(body)).encode()
+                + b'\r\n\r\n'
+                + body
+            )
+            await writer.drain()
+        writer.close()
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def evok(loop):
+    evok = FakeEvok()
+    server = loop.run_until_complete(
+        asyncio.start_server(evok.handle, '127.0.0.1', 0)
+    )
+    evok.url = 'http://127.0.0.1:{}/rpc'.format(
+        server.sockets[0].getsockname()[1]
+    )
+    yield evok
+    # Let the handlers notice the closed connections.
+    loop.run_until_complete(asyncio.sleep(0.01))
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+
+
+@pytest.fixture
+def wm(evok):
+    wm = AsyncWashMachine('test wash machine', unipi_jsonrpc_url=evok.url)
+    wm.init_io()
+    wm.tick_secs = 0.001
+    for mv in wm.io.mv.all_leafs():
+        mv.transition_time = 0.001
+    yield wm
+    wm.unipi_jsonrpc_async.close()
+    wm.unipi_jsonrpc.session.close()
+
+
+def test_async_client(loop, evok):
+    client = jsonrpc.AsyncClient(evok.url)
+
+    async def calls():
+        await client.relay_set('al_air', True)
+        assert await client.relay_get('al_air') == [1, 0]
+        with pytest.raises(jsonrpc.ProtocolError):
+            await client._jsonrpc_args_method('unknown')
+        async with client.batch() as batch:
+            air = batch.relay_get('al_air')
+            fuse = batch.input_get_value('al_fuse_ok')
+        assert air.result() == [1, 0]
+        assert fuse.result() == 1
+
+    loop.run_until_complete(calls())
+    client.close()
+    assert evok.requests == 4
+
+
+def test_async_client_coalesced(loop, evok):
+    client = jsonrpc.AsyncClient(evok.url)
+
+    async def calls():
+        return await asyncio.gather(
+            client.relay_get('al_air'),
+            client.relay_get('al_air'),
+            client.relay_get('al_pump'),
+        )
+
+    assert loop.run_until_complete(calls()) == [[0, 0], [0, 0], [0, 0]]
+    client.close()
+    assert evok.requests == 2
+    assert client.coalesced == 1
+
+
+def test_async_client_coalesced_leader_cancelled(loop, evok):
+    client = jsonrpc.AsyncClient(evok.url)
+    send_now = client._send_now
+
+    async def slow_send_now(payload):
+        await asyncio.sleep(0.05)
+        return await send_now(payload)
+
+    async def calls():
+        leader = asyncio.ensure_future(client.relay_get('al_air'))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(client.relay_get('al_air'))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == [0, 0]
+        assert leader.cancelled()
+
+    with patch.object(client, '_send_now', slow_send_now):
+        loop.run_until_complete(calls())
+    client.close()
+    assert client.coalesced == 1
+
+
+def test_async_client_timeout(loop, evok):
+    client = jsonrpc.AsyncClient(evok.url, timeout=(0.05, 0.05), backoff=0)
+
+    async def hanging_exchange(streams, data):
+        await asyncio.sleep(1)
+
+    async def call():
+        with pytest.raises(asyncio.TimeoutError):
+            await client.relay_get('al_air')
+
+    with patch.object(client, '_exchange', hanging_exchange):
+        loop.run_until_complete(call())
+    assert client.health()['timeouts'] == 3
+    assert client.health()['retried'] == 2
+
+
+def test_async_phases(loop, evok, wm):
+    async def phases():
+        await wm.check()
+        for phase in (
+            wm.prewash,
+            wm.drain,
+            wm.wash_with_lye,
+            wm.rinse_with_cold_water,
+            wm.wash_with_hot_water,
+            wm.dry,
+            wm.fill_with_co2,
+        ):
+            await phase()
+            await wm.reset()
+            assert not any(evok.relays.values())
+
+    loop.run_until_complete(phases())
+    assert wm.current_phase == 'idle'
+
+
+def test_async_wash_the_kegs(loop, evok, wm):
+    wm.keep_running = MagicMock(side_effect=[True, False])
+    wm.keep_repeating = MagicMock(return_value=True)
+    wm.wash_cycle = [wm.wait_for_keg, wm.heating, wm.fill_with_co2]
+    loop.run_until_complete(wm.wash_the_kegs())
+    assert not evok.relays.get('al_error_lamp')
+
+
+def test_async_temps_update(loop, evok, wm):
+    wm.keep_running = MagicMock(side_effect=[True, False])
+    wm.real_temp_update_seconds = 0
+    loop.run_until_complete(wm.temps_update())
+    assert wm.temp_log.temps_list() == [80.5]
+
+
+def test_async_phases_shared(loop, evok):
+    wm = AsyncWashMachine(
+        'test wash machine', unipi_jsonrpc_url=evok.url, clock=VirtualClock()
+    )
+    wm.init_io()
+    assert wm.phases == WashMachine('sync').phases
+    loop.run_until_complete(wm.fill_with_co2())
+    wm.unipi_jsonrpc_async.close()
+    wm.unipi_jsonrpc.session.close()
+    # The delay is scheduled on the clock of the machine, 7.5 ticks of 1s.
+    assert wm.clock.monotonic() == 7.5
+    steps = wm.schedules['filling with CO2'].steps
+    assert [step.name for step in steps] == ['delay 7.5']
+
+
+def test_async_inputs_ok_from_watcher(loop, evok, wm):
+    wm._blocking = MagicMock()
+    wm.input_watcher.updated = wm.clock.monotonic()
+    wm.safety._update({'total_stop': 0, 'fuse_ok': 1})
+    loop.run_until_complete(wm.delay(1))
+    assert not wm._blocking.called
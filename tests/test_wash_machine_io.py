@@ -0,0 +1,224 @@
+import pytest
+import threading
+
+from pivovar import wash_machine_io as wm_io
+from pivovar.clock import VirtualClock
+from pivovar.jsonrpc import Client, ProtocolError
+
+from .themock import MagicMock
+
+
+class Facility(object):
+    def __init__(self, ttl):
+        self.name = 'facility'
+        self.unipi_jsonrpc = Client('http://fake/rpc')
+        self.unipi_jsonrpc._post = MagicMock()
+        self.io_cache = wm_io.ReadCache(ttl)
+        self.clock = VirtualClock()
+        self.shadow_resync_seconds = 60
+
+    def respond(self, *results):
+        def post(requests):
+            if isinstance(requests, dict):
+                return results[0]
+            return [
+                dict(result, id=request['id'])
+                for request, result in zip(requests, results)
+            ]
+
+        self.unipi_jsonrpc._post.side_effect = post
+
+
+@pytest.fixture
+def facility():
+    yield Facility(ttl=10)
+
+
+def test_read_cache_disabled():
+    facility = Facility(ttl=0)
+    facility.unipi_jsonrpc._post.return_value = {'result': 1}
+    inp = wm_io.Input('keg_present', facility, 'al_keg_present')
+    assert inp.read_state() == 1
+    assert inp.read_state() == 1
+    assert facility.unipi_jsonrpc._post.call_count == 2
+
+
+def test_read_cache_snapshot(facility):
+    keg = wm_io.Input('keg_present', facility, 'al_keg_present')
+    air = wm_io.Switchable('air', facility, 'al_air')
+
+    facility.respond({'result': 1})
+    assert keg.read_state() == 1
+    facility.respond({'result': 0}, {'result': [1, 0]})
+    assert air.read_state() == 1
+    assert keg.read_state() == 0
+    assert air.read_state() == 1
+    assert facility.unipi_jsonrpc._post.call_count == 2
+
+
+def test_read_cache_ttl(facility):
+    keg = wm_io.Input('keg_present', facility, 'al_keg_present')
+    facility.respond({'result': 1})
+    clock = facility.io_cache.clock = VirtualClock()
+    keg.read_state()
+    clock.sleep(5)
+    keg.read_state()
+    assert facility.unipi_jsonrpc._post.call_count == 1
+    clock.sleep(6)
+    keg.read_state()
+    assert facility.unipi_jsonrpc._post.call_count == 2
+
+
+def test_read_cache_invalidated_by_write(facility):
+    air = wm_io.Switchable('air', facility, 'al_air')
+    facility.respond({'result': [0, 0]})
+    assert air.read_state() == 0
+    facility.respond({'result': True})
+    air.turn_on()
+    facility.respond({'result': [1, 0]})
+    assert air.read_state() == 1
+
+
+def blocking_post(facility):
+    """Make the calls of ``facility`` block until the returned event is set,
+    return also the event set once a call is in flight."""
+    posting = threading.Event()
+    release = threading.Event()
+    respond = facility.unipi_jsonrpc._post.side_effect
+
+    def post(requests):
+        posting.set()
+        release.wait(5)
+        return respond(requests)
+
+    facility.unipi_jsonrpc._post.side_effect = post
+    return posting, release
+
+
+def test_read_cache_refresh_outside_lock(facility):
+    keg = wm_io.Input('keg_present', facility, 'al_keg_present')
+    facility.respond({'result': 1})
+    posting, release = blocking_post(facility)
+    results = []
+    readers = [
+        threading.Thread(target=lambda: results.append(keg.read_state()))
+        for _ in range(2)
+    ]
+    readers[0].start()
+    assert posting.wait(5)
+    readers[1].start()
+    assert facility.io_cache._lock.acquire(timeout=5)
+    facility.io_cache._lock.release()
+    release.set()
+    for reader in readers:
+        reader.join(5)
+    assert results == [1, 1]
+    assert facility.unipi_jsonrpc._post.call_count == 1
+
+
+def test_read_cache_invalidated_during_refresh(facility):
+    keg = wm_io.Input('keg_present', facility, 'al_keg_present')
+    facility.respond({'result': 1})
+    posting, release = blocking_post(facility)
+    reader = threading.Thread(target=keg.read_state)
+    reader.start()
+    assert posting.wait(5)
+    facility.io_cache.invalidate()
+    release.set()
+    reader.join(5)
+    # The refresh overlapping the write was not trusted.
+    assert facility.unipi_jsonrpc._post.call_count == 2
+    assert keg.read_state() == 1
+    assert facility.unipi_jsonrpc._post.call_count == 2
+
+
+def test_shadow_skips_redundant_writes(facility):
+    air = wm_io.Switchable('air', facility, 'al_air')
+    facility.respond({'result': True})
+    assert air.turn_on()
+    assert not air.turn_on()
+    assert facility.unipi_jsonrpc._post.call_count == 1
+    facility.clock.sleep(61)
+    assert air.turn_on()
+    assert facility.unipi_jsonrpc._post.call_count == 2
+
+
+def test_shadow_forgotten_on_error(facility):
+    air = wm_io.Switchable('air', facility, 'al_air')
+    facility.respond({'result': True})
+    air.turn_off()
+    facility.respond({'error': {'message': 'failed', 'code': -1}})
+    with pytest.raises(ProtocolError):
+        air.turn_on()
+    assert air.shadow is None
+    facility.respond({'result': True})
+    assert air.turn_off()
+
+
+def test_shadow_states(facility):
+    air = wm_io.Switchable('air', facility, 'al_air')
+    pump = wm_io.Switchable('pump', facility, 'al_pump')
+    facility.respond({'result': True})
+    air.turn_on()
+    facility.respond({'result': [0, 0]})
+    assert wm_io.shadow_states(facility.unipi_jsonrpc, [air, pump]) == [
+        True,
+        0,
+    ]
+    assert facility.unipi_jsonrpc._post.call_count == 2
+    assert wm_io.shadow_states(facility.unipi_jsonrpc, [air, pump]) == [
+        True,
+        False,
+    ]
+    wm_io.set_states(facility.unipi_jsonrpc, [air, pump], False)
+    wm_io.set_states(facility.unipi_jsonrpc, [air, pump], False)
+    assert facility.unipi_jsonrpc._post.call_count == 3
+    assert air.shadow is False
+
+
+def test_motor_valve_actuation(facility):
+    valve = wm_io.MotorValve('water_or_lye', facility, 'al_water_or_lye', 5)
+    clock = facility.clock
+    facility.respond({'result': True})
+    actuation = valve.turn_on(wait=False)
+    assert actuation.remaining() == 5
+    clock.sleep(2)
+    assert not actuation.done()
+    # Already on, only the rest of the move is waited for.
+    valve.turn_on()
+    assert clock.monotonic() == 5
+    assert actuation.done()
+    assert facility.unipi_jsonrpc._post.call_count == 1
+    valve.turn_off()
+    assert clock.monotonic() == 10
+
+
+def test_plan_transition(facility):
+    air, pump, valve = [
+        wm_io.Switchable(name, facility, 'al_' + name)
+        for name in ('air', 'pump', 'valve')
+    ]
+    assert wm_io.plan_transition(
+        [air, pump, valve], [1, 0, 1], [False, True, None]
+    ) == ([pump], [air])
+    assert wm_io.plan_transition(
+        [air, pump, valve], [0, True, 0], [False, True, None]
+    ) == ([], [])
+
+
+def test_read_cache_error(facility):
+    sensor = wm_io.TemperatureSensor('water_temp', facility, 'missing')
+    facility.respond({'error': {'message': 'not found', 'code': -1}})
+    assert not sensor.is_defined()
+    with pytest.raises(ProtocolError):
+        sensor.read_temperature()
+
+
+def test_read_temperature_single_read(facility):
+    sensor = wm_io.TemperatureSensor('water_temp', facility, '2869')
+    facility.io_cache.ttl = 0
+    facility.unipi_jsonrpc._post.return_value = {
+        'result': [80.2, False, 0, 15]
+    }
+    assert sensor.read_temperature() == 80.2
+    assert facility.unipi_jsonrpc._post.call_count == 1
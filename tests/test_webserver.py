@@ -0,0 +1,44 @@
+import requests
+
+from pivovar.webserver import CachedDocument
+
+from .themock import MagicMock, patch
+
+
+def response(status_code=200, document=None, etag='"1"'):
+    resp = MagicMock(status_code=status_code, headers={'ETag': etag})
+    resp.json.return_value = document
+    return resp
+
+
+@patch('pivovar.webserver.time')
+def test_cached_document(time_mock):
+    time_mock.monotonic.return_value = 0.0
+    session = MagicMock()
+    session.get.return_value = response(document={'current_phase': 'idle'})
+    doc = CachedDocument('http://wash/wash_machine', 2, 1, session)
+
+    assert doc.get() == {'current_phase': 'idle'}
+    assert doc.get() == {'current_phase': 'idle'}
+    assert session.get.call_count == 1
+    assert session.get.call_args[1]['timeout'] == 1
+
+    time_mock.monotonic.return_value = 3.0
+    session.get.return_value = response(status_code=304)
+    with patch('pivovar.webserver.threading.Thread') as thread:
+        # The stale document is served, the refresh runs in background.
+        assert doc.get() == {'current_phase': 'idle'}
+        assert doc.get() == {'current_phase': 'idle'}
+        assert thread.call_count == 1
+    thread.call_args[1]['target']()
+    assert session.get.call_args[1]['headers'] == {'If-None-Match': '"1"'}
+    assert doc.fetched == 3.0
+    assert doc.document == {'current_phase': 'idle'}
+
+
+def test_cached_document_unavailable():
+    session = MagicMock()
+    session.get.side_effect = requests.ConnectionError()
+    doc = CachedDocument('http://wash/wash_machine', 2, 1, session)
+    assert doc.get() is None
+    assert doc.fetched is None
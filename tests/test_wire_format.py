@@ -0,0 +1,57 @@
+from array import array
+import gzip
+import math
+
+from flask import Flask, Response
+
+from pivovar import wire_format
+
+
+def test_encode_times():
+    times = [1535115834.0, 1535115849.2, 1535115864.0]
+    assert wire_format.encode_times(times, 'epoch') == {
+        'time': [1535115834, 1535115849, 1535115864]
+    }
+    assert wire_format.encode_times(times, 'delta') == {
+        'start': 1535115834,
+        'deltas': [15, 15],
+    }
+    assert wire_format.encode_times([], 'delta') == {
+        'start': None,
+        'deltas': [],
+    }
+
+
+def test_encode_columns():
+    body = wire_format.encode_columns([1.0, 2.0], [80.5, math.nan])
+    times = array('d', body[:16])
+    temps = array('f', body[16:])
+    assert list(times) == [1.0, 2.0]
+    assert temps[0] == 80.5
+    assert math.isnan(temps[1])
+
+
+def test_choose_encoding():
+    assert wire_format.choose_encoding('gzip, deflate, br') == 'gzip'
+    assert wire_format.choose_encoding('deflate;q=0.5, gzip;q=0') == (
+        'deflate'
+    )
+    assert wire_format.choose_encoding('identity') is None
+    assert wire_format.choose_encoding(None) is None
+
+
+def test_compress():
+    app = Flask(__name__)
+    with app.test_request_context():
+        response = Response('[1, 2, 3]' * 100, mimetype='application/json')
+        response.set_etag('abc')
+        response = wire_format.compress(response, 'gzip')
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.get_etag() == ('abc', True)
+        assert gzip.decompress(response.get_data()) == b'[1, 2, 3]' * 100
+
+        small = Response('[]', mimetype='application/json')
+        assert (
+            'Content-Encoding'
+            not in wire_format.compress(small, 'gzip').headers
+        )